@@ -1,17 +1,211 @@
 import os
-from flask import Flask, request, jsonify, abort, send_from_directory
+import hashlib
+import heapq
+import importlib.util
+import math
+import random
+import re
+import tempfile
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from flask import Flask, Response, request, jsonify, abort, send_from_directory, url_for
 from flask_cors import CORS
 import json
 import pymongo
 import redis
-from werkzeug.utils import secure_filename
+import click
+from redis.exceptions import LockError, ResponseError
 
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+# Ikeliamas failas skaitomas ir hashuojamas tokio dydzio dalimis
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Paveikslelio failo vardas - sha256 hex ir pletinys
+IMAGE_NAME_RE = re.compile(r"^([0-9a-f]{64})\.(jpg|png)$")
+
+# Populiariausiu patiekalu reitingai (Redis sorted set, narys - patiekalo ID, balas - uzsakytas kiekis)
+POPULAR_KEY = "popular:dishes"
+POPULAR_DAILY_KEY = "popular:dishes:{day}" # UTC data YYYY-MM-DD
+POPULAR_RESTAURANT_KEY = "popular:restaurant:{restaurant_id}"
+POPULAR_RESTAURANT_DAILY_KEY = "popular:restaurant:{restaurant_id}:{day}"
+POPULAR_NAMES_KEY = "popular:names" # patiekalo ID -> JSON su patiekalo ir restorano pavadinimais
+POPULAR_RESTAURANTS_KEY = "popular:restaurants" # narys - restorano ID
+# Atstatomi reitingai rasomi i laikinus raktus ir pervadinami; ZADD su tiek nariu
+POPULAR_REBUILD_KEY = "rebuild:{key}"
+POPULAR_REBUILD_CHUNK_SIZE = 1000
+DEFAULT_POPULAR_LIMIT = 10
+MAX_POPULAR_LIMIT = 100
+
+# Didziausias uzsakymu puslapis ir uzsakymu perkelimo is customers.orders paketas
+MAX_ORDERS_PAGE = 100
+# Didziausias restoranu ir klientu sarasu puslapis
+MAX_LIST_PAGE = 1000
+DEFAULT_ORDER_MIGRATION_BATCH_SIZE = 500
+
+# Uzsakymu eile (ORDER_QUEUE): Redis Stream ir ja skaitanciu darbininku grupe
+ORDER_STREAM = "orders:stream"
+ORDER_GROUP = "order-writers"
+ORDER_STATUS_KEY = "order_status:{}"
+# Irasai, kuriu nepavyko irasyti i MongoDB, perkeliami cia (ilgis apribotas apytiksliai)
+ORDER_DEAD_LETTER_STREAM = "orders:dead"
+ORDER_DEAD_LETTER_MAXLEN = 10000
+# Darbininko laukimas po klaidos, sekundemis (dvigubinamas iki didziausio)
+ORDER_WORKER_MIN_BACKOFF = 0.5
+ORDER_WORKER_MAX_BACKOFF = 30
+# Laikinas MongoDB ar Redis neprieinamumas - tokie paketai kartojami neribotai
+TRANSIENT_ORDER_ERRORS = (pymongo.errors.ConnectionFailure, redis.exceptions.ConnectionError,
+                          redis.exceptions.TimeoutError)
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# Autocomplete: visu nariu balas 0, todel ZRANGEBYLEX grazina juos abeceles tvarka.
+# Narys - "normalizuotas pavadinimas nuo kurio nors zodzio\x00JSON [tipas, ID, pavadinimas, restorano ID]"
+AUTOCOMPLETE_KEY = "autocomplete:names"
+DEFAULT_AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 50
+
+# Meniu cache: restorano meniu versija didinama kiekvieno pakeitimo metu, epocha - po cleanup,
+# todel po isvalymo versijos neprasideda is naujo ir seni ETag nesutampa
+MENU_EPOCH_KEY = "menu:epoch"
+MENU_VERSION_KEY = "menu:version:{}"
+MENU_CACHE_KEY = "menu:{}:{}" # restorano ID, versijos zyme
+
+
+def tokenize(text):
+    # Mazosios raides be diakritiniu zenklu, kad "cepelinai" rastu ir "Cepelinai", "sriuba" - "sriubą"
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.findall(r"\w+", text)
+
+
+class SearchIndex:
+    """In-memory inverted index with BM25 ranking.
+
+    Documents are added and removed by id; search() returns (id, score)
+    pairs, best first. Thread safe.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._postings = {} # terminas -> {dokumento ID: daznis}
+            self._terms = {}    # dokumento ID -> jo terminai
+            self._lengths = {}
+            self._total_length = 0
+
+    def add(self, doc_id, text):
+        tokens = tokenize(text)
+        with self._lock:
+            self._remove(doc_id)
+            frequencies = {}
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+            for token, frequency in frequencies.items():
+                self._postings.setdefault(token, {})[doc_id] = frequency
+            self._terms[doc_id] = list(frequencies)
+            self._lengths[doc_id] = len(tokens)
+            self._total_length += len(tokens)
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        for token in self._terms.pop(doc_id, []):
+            postings = self._postings[token]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[token]
+        self._total_length -= self._lengths.pop(doc_id, 0)
+
+    def search(self, query):
+        """Return (doc_id, score) of the documents matching any query term, best first."""
+        with self._lock:
+            count = len(self._lengths)
+            if not count:
+                return []
+            average_length = self._total_length / count or 1
+
+            scores = {}
+            for token in set(tokenize(query)):
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+# Runs in a worker process: writes a copy of source scaled to fit in size x size pixels
+def make_thumbnail(source, target, size):
+    from PIL import Image
+
+    if os.path.exists(target):
+        return target
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with Image.open(source) as image:
+        image_format = image.format
+        image.thumbnail((size, size))
+        if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        # Irasome i laikina faila, kad nebaigta miniatiura nebutu pateikta
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target))
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                image.save(tmp, format=image_format)
+            os.replace(tmp_path, target)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return target
 
 def create_app():
     app = Flask(__name__)
     CORS(app) # Leidzia kirsti narsukles uzklausas (naudinga Frontend)
     app.config['UPLOAD_FOLDER'] = './uploads' # Katalogas paveiksleliams saugoti
+    # Uzsakymai tikrinami pagal sio proceso atmintyje laikomus restoranu patiekalu ID.
+    # Restorano istrynimas kitame procese cia nematomas, todel pagal nutylejima isjungta
+    app.config.setdefault('ORDER_MENU_CACHE', False)
+    # Uzsakymai priimami i Redis Stream ir atsakoma 202, i MongoDB juos iraso `flask order-workers`
+    app.config.setdefault('ORDER_QUEUE', False)
+    app.config.setdefault('ORDER_STATUS_TTL', 24 * 3600)
+    # Po kiek milisekundziu neatsakyti kito darbininko irasai perimami
+    app.config.setdefault('ORDER_CLAIM_IDLE_MS', 60000)
+    # Kiek uzsakymo ID procesas rezervuoja vienu kartu. Su 1 ID didera uzsakymu sukurimo tvarka.
+    # Didesnis blokas taupo uzklausas, bet keli procesai ID isduoda is skirtingu bloku, todel
+    # seq nebeatitinka chronologijos: klientu uzsakymai "naujausi pirmi" ir rekomendaciju
+    # "paskutinis uzsakymas" gali buti rikiuojami netiksliai
+    app.config.setdefault('ORDER_ID_BLOCK_SIZE', 1)
+    # Po kiek nepavykusiu bandymu atskiras irasas perkeliamas i ORDER_DEAD_LETTER_STREAM
+    app.config.setdefault('ORDER_MAX_ATTEMPTS', 5)
+    app.config.setdefault('MENU_CACHE_TTL', 3600)
+    # Rekomendaciju cache galiojimas sekundemis; kiekvienam raktui pridedamas +-JITTER dalies
+    # atsitiktinis nuokrypis, kad raktai nenustotu galioti vienu metu
+    app.config.setdefault('RECOMMENDATIONS_TTL', 3600)
+    app.config.setdefault('RECOMMENDATIONS_TTL_JITTER', 0.1)
+    # Sena reiksme grazinama, kol kitas procesas skaiciuoja nauja
+    app.config.setdefault('RECOMMENDATIONS_STALE_TTL', 24 * 3600)
+    app.config.setdefault('RECOMMENDATIONS_LOCK_TIMEOUT', 30)
+    # Kiek dienu saugomi dienos populiarumo reitingai
+    app.config.setdefault('POPULAR_DAILY_DAYS', 8)
+    # Kiek abeceles tvarka pirmu prefiksa atitinkanciu pavadinimu /autocomplete reitinguoja pagal populiaruma
+    app.config.setdefault('AUTOCOMPLETE_SCAN', 200)
+    # Miniaturu krastines pikseliais (?size=N grazina maziausia ne mazesne uz N) ir jas kuriantys procesai
+    app.config.setdefault('THUMBNAIL_SIZES', [100, 400])
+    app.config.setdefault('THUMBNAIL_WORKERS', 2)
+    # Paveiksleliu failu vardai yra ju turinio hash, todel juos galima cache'uoti ilgai
+    app.config.setdefault('IMAGE_CACHE_MAX_AGE', 365 * 24 * 3600)
 
     # Sukuriame kataloga, jei jo nera
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -24,6 +218,8 @@ def create_app():
     collection_restaurants = db["restaurants"]
     collection_customers = db["customers"]
     collection_counters = db["counters"] # New collection for counters
+    # Uzsakymai saugomi atskirai; seq - skaitinis uzsakymo ID rikiavimui (_id yra eilute)
+    collection_orders = db["orders"]
 
     #collection_restaurants.drop_index("menu.name_text_menu.description_text")
 
@@ -32,6 +228,7 @@ def create_app():
     # Indeksai spartesnei rekomendaciju paieskai
     collection_restaurants.create_index("menu._id")
     collection_customers.create_index("orders.items.menu_item_id")
+    collection_orders.create_index([("customer_id", pymongo.ASCENDING), ("seq", pymongo.DESCENDING)])
 
     # Initialize the counters collection if it doesn't exist
     def initialize_counters():
@@ -56,10 +253,366 @@ def create_app():
         )
         return str(sequence["seq"]) # Return as a string
 
+    # $project stage keeping the restaurant name and only the given menu items
+    def project_menu_items(menu_item_ids):
+        return {"$project": {
+            "name": 1,
+            "menu": {"$filter": {
+                "input": "$menu",
+                "as": "menu_item",
+                "cond": {"$in": ["$$menu_item._id", menu_item_ids]}
+            }}
+        }}
+
+    # Patiekalai pagal ID is visu restoranu viena uzklausa.
+    # Returns {menu_item_id: (restaurant_id, restaurant_name, menu_item)}
+    def find_menu_items(menu_item_ids):
+        menu_item_ids = list(set(menu_item_ids))
+        pipeline = [
+            {"$match": {"menu._id": {"$in": menu_item_ids}}},
+            project_menu_items(menu_item_ids)
+        ]
+
+        menu_items = {}
+        for restaurant in collection_restaurants.aggregate(pipeline):
+            for menu_item in restaurant["menu"]:
+                menu_items[menu_item["_id"]] = (restaurant["_id"], restaurant["name"], menu_item)
+        return menu_items
+
+    # ==== POPULIARUMO REITINGAI ====
+    # (key, member, quantity, daily) increments of the global and restaurant rankings for the
+    # ordered items and, with `day` (UTC date of the order), of that day's rankings (daily=True)
+    def popular_increments(items, day=None):
+        for item in items:
+            restaurant_id = item["restaurant_id"]
+            quantity = item["quantity"]
+            yield POPULAR_KEY, item["menu_item_id"], quantity, False
+            yield POPULAR_RESTAURANT_KEY.format(restaurant_id=restaurant_id), item["menu_item_id"], quantity, False
+            if day is not None:
+                yield POPULAR_DAILY_KEY.format(day=day), item["menu_item_id"], quantity, True
+                yield (POPULAR_RESTAURANT_DAILY_KEY.format(restaurant_id=restaurant_id, day=day),
+                       item["menu_item_id"], quantity, True)
+            yield POPULAR_RESTAURANTS_KEY, restaurant_id, quantity, False
+
+    # Dienos reitingai istrinami praejus POPULAR_DAILY_DAYS dienu nuo tos dienos pradzios
+    def popular_daily_expire_at(day):
+        return datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc) + \
+            timedelta(days=app.config['POPULAR_DAILY_DAYS'])
+
+    # Queue ZINCRBY of the ordered quantities into the popularity rankings
+    def count_popular_items(pipe, items, day=None):
+        daily_keys = set()
+        for key, member, quantity, daily in popular_increments(items, day):
+            pipe.zincrby(key, quantity, member)
+            if daily:
+                daily_keys.add(key)
+
+        for key in daily_keys:
+            pipe.expireat(key, popular_daily_expire_at(day))
+
+    def order_day(created_at):
+        return created_at.strftime("%Y-%m-%d")
+
+    def popular_keys():
+        return list(redis_client.scan_iter(match="popular:*"))
+
+    # Top `limit` dishes of a ranking with their names. Names are cached in a Redis hash,
+    # the ones not cached yet are looked up with one query
+    def top_dishes(key, limit):
+        ranking = redis_client.zrevrange(key, 0, limit - 1, withscores=True)
+        if not ranking:
+            return []
+
+        menu_item_ids = [member.decode() for member, _ in ranking]
+        names = dict(zip(menu_item_ids, redis_client.hmget(POPULAR_NAMES_KEY, menu_item_ids)))
+
+        missing = [menu_item_id for menu_item_id, name in names.items() if name is None]
+        if missing:
+            found = {}
+            for menu_item_id, (restaurant_id, restaurant_name, menu_item) in find_menu_items(missing).items():
+                found[menu_item_id] = json.dumps({
+                    "menu_item_name": menu_item["name"],
+                    "restaurant_id": restaurant_id,
+                    "restaurant_name": restaurant_name
+                })
+            if found:
+                redis_client.hset(POPULAR_NAMES_KEY, mapping=found)
+            names.update(found)
+
+        dishes = []
+        for (_, score), menu_item_id in zip(ranking, menu_item_ids):
+            # Istrinto restorano patiekalai praleidziami
+            if names[menu_item_id] is None:
+                continue
+            dishes.append({"menu_item_id": menu_item_id, **json.loads(names[menu_item_id]), "popularity": int(score)})
+        return dishes
+
+    # Top dishes of the whole period or of today (period=day), limit - how many.
+    # daily_key(day) returns the key of that day's ranking
+    def popular_response(key, daily_key):
+        period = request.args.get("period", "all")
+        if period not in ("all", "day"):
+            return jsonify({"message": "period must be 'all' or 'day'"}), 400
+        limit = min(max(request.args.get("limit", DEFAULT_POPULAR_LIMIT, type=int), 1), MAX_POPULAR_LIMIT)
+
+        if period == "day":
+            key = daily_key(order_day(datetime.now(timezone.utc)))
+
+        return jsonify(top_dishes(key, limit)), 200
+
+    @app.cli.command("rebuild-popular-dishes")
+    def rebuild_popular_dishes_command():
+        """Rebuild the popular dishes rankings from the order history."""
+        oldest_day = datetime.now(timezone.utc) - timedelta(days=app.config['POPULAR_DAILY_DAYS'])
+
+        # Kiekiai sudedami atmintyje, kiekvienas reitingas irasomas viena karta
+        scores = defaultdict(Counter)
+        expire_at = {}
+
+        # Senesni ir be datos issaugoti uzsakymai skaiciuojami tik bendruose reitinguose
+        def replay(order):
+            created_at = order.get("created_at")
+            day = None
+            if created_at is not None and created_at.replace(tzinfo=timezone.utc) >= oldest_day:
+                day = order_day(created_at)
+            for key, member, quantity, daily in popular_increments(order["items"], day):
+                scores[key][member] += quantity
+                if daily:
+                    expire_at[key] = popular_daily_expire_at(day)
+
+        # Dar neperkelti uzsakymai is customers.orders; perkelimo metu uzsakymas gali buti abiejose vietose
+        legacy_ids = set()
+        for customer in collection_customers.find({"orders.0": {"$exists": True}}, {"orders": 1}):
+            for order in customer["orders"]:
+                legacy_ids.add(order["_id"])
+                replay(order)
+
+        orders = len(legacy_ids)
+        for order in collection_orders.find({}, {"items": 1, "created_at": 1}):
+            if order["_id"] not in legacy_ids:
+                replay(order)
+                orders += 1
+
+        # Reitingai surasomi i laikinus raktus ZADD komandomis po POPULAR_REBUILD_CHUNK_SIZE nariu
+        pipe = redis_client.pipeline(transaction=False)
+        pending = 0
+        for key, counts in scores.items():
+            staging_key = POPULAR_REBUILD_KEY.format(key=key)
+            pipe.delete(staging_key)
+            members = list(counts.items())
+            for start in range(0, len(members), POPULAR_REBUILD_CHUNK_SIZE):
+                chunk = dict(members[start:start + POPULAR_REBUILD_CHUNK_SIZE])
+                pipe.zadd(staging_key, chunk)
+                pending += len(chunk)
+                if pending >= POPULAR_REBUILD_CHUNK_SIZE:
+                    pipe.execute()
+                    pending = 0
+        pipe.execute()
+
+        # Seni reitingai pakeiciami viena MULTI transakcija, skaitytojai nemato pusiau atstatytu reitingu
+        pipe = redis_client.pipeline(transaction=True)
+        for key in popular_keys():
+            pipe.delete(key)
+        for key in scores:
+            pipe.rename(POPULAR_REBUILD_KEY.format(key=key), key)
+            if key in expire_at:
+                pipe.expireat(key, expire_at[key])
+        pipe.execute()
+        click.echo(f"Replayed {orders} orders")
+
+    @app.cli.command("migrate-orders")
+    @click.option("--batch-size", default=DEFAULT_ORDER_MIGRATION_BATCH_SIZE, show_default=True)
+    def migrate_orders_command(batch_size):
+        """Move orders embedded in customers.orders to the orders collection."""
+        moved = 0
+        for customer in collection_customers.find({"orders.0": {"$exists": True}}, {"_id": 1}):
+            while True:
+                # Pirmiausia irasome i orders (upsert - migracija galima kartoti), tik tada
+                # pasaliname is kliento, todel uzsakymas visada matomas bent vienoje vietoje
+                batch = collection_customers.find_one({"_id": customer["_id"]}, {"orders": {"$slice": batch_size}})
+                orders = batch.get("orders", []) if batch else []
+                if not orders:
+                    break
+
+                collection_orders.bulk_write([
+                    pymongo.ReplaceOne(
+                        {"_id": order["_id"]},
+                        {**order, "seq": int(order["_id"]), "customer_id": customer["_id"]},
+                        upsert=True
+                    )
+                    for order in orders
+                ], ordered=False)
+                collection_customers.update_one(
+                    {"_id": customer["_id"]},
+                    {"$pull": {"orders": {"_id": {"$in": [order["_id"] for order in orders]}}}}
+                )
+                moved += len(orders)
+                click.echo(f"Moved {moved} orders")
+
+    # Uzsakymu elementuose minimi restoranai ir patiekalai gaunami viena uzklausa,
+    # is restorano meniu paliekami tik reikalingi patiekalai.
+    # Returns ({restaurant_id: name}, {(restaurant_id, menu_item_id): menu_item})
+    def load_order_items(items):
+        restaurant_ids = list({item["restaurant_id"] for item in items})
+        menu_item_ids = list({item["menu_item_id"] for item in items})
+        pipeline = [
+            {"$match": {"_id": {"$in": restaurant_ids}}},
+            project_menu_items(menu_item_ids)
+        ]
+
+        restaurant_names = {}
+        menu_items = {}
+        for restaurant in collection_restaurants.aggregate(pipeline):
+            restaurant_names[restaurant["_id"]] = restaurant["name"]
+            for menu_item in restaurant["menu"]:
+                menu_items[(restaurant["_id"], menu_item["_id"])] = menu_item
+        return restaurant_names, menu_items
+
+    # ==== PAIESKOS INDEKSAS ====
+    # Patiekalai indeksuojami pagal pavadinima ir aprasyma, restoranai - pagal pavadinima.
+    # Indeksas laikomas sio proceso atmintyje: atstatomas paleidziant ir atnaujinamas sio proceso rasymu
+    dish_index = SearchIndex()
+    restaurant_index = SearchIndex()
+    search_restaurants = {} # restorano ID -> name, address, working_hours
+    search_dishes = {}      # patiekalo ID -> patiekalas su restaurant_id
+    search_lock = threading.Lock()
+
+    def index_restaurant(restaurant):
+        with search_lock:
+            search_restaurants[restaurant["_id"]] = {
+                "name": restaurant["name"],
+                "address": restaurant.get("address", ""),
+                "working_hours": restaurant.get("working_hours", "")
+            }
+        restaurant_index.add(restaurant["_id"], restaurant["name"])
+        for dish in restaurant.get("menu", []):
+            index_dish(restaurant["_id"], dish)
+
+    def index_dish(restaurant_id, dish):
+        with search_lock:
+            search_dishes[dish["_id"]] = {**dish, "restaurant_id": restaurant_id}
+        dish_index.add(dish["_id"], f"{dish.get('name', '')} {dish.get('description', '')}")
+
+    def unindex_restaurant(restaurant_id):
+        with search_lock:
+            search_restaurants.pop(restaurant_id, None)
+            dish_ids = [dish_id for dish_id, dish in search_dishes.items() if dish["restaurant_id"] == restaurant_id]
+            for dish_id in dish_ids:
+                del search_dishes[dish_id]
+        restaurant_index.remove(restaurant_id)
+        for dish_id in dish_ids:
+            dish_index.remove(dish_id)
+
+    def rebuild_search_index():
+        with search_lock:
+            search_restaurants.clear()
+            search_dishes.clear()
+        dish_index.clear()
+        restaurant_index.clear()
+        projection = {"name": 1, "address": 1, "working_hours": 1, "menu._id": 1,
+                      "menu.name": 1, "menu.description": 1, "menu.price": 1}
+        for restaurant in collection_restaurants.find({}, projection):
+            index_restaurant(restaurant)
+
+    rebuild_search_index()
+
+    # ==== AUTOCOMPLETE ====
+    # Members for a restaurant or dish name, one for every word it starts from,
+    # so "pizza" also finds "Margherita pizza"
+    def autocomplete_members(kind, id, name, restaurant_id=None):
+        words = tokenize(name)
+        payload = json.dumps([kind, id, name, restaurant_id])
+        return [" ".join(words[i:]) + "\x00" + payload for i in range(len(words))]
+
+    def restaurant_autocomplete_members(restaurant):
+        members = autocomplete_members("restaurant", restaurant["_id"], restaurant["name"])
+        for dish in restaurant.get("menu", []):
+            members += autocomplete_members("dish", dish["_id"], dish["name"], restaurant["_id"])
+        return members
+
+    def rebuild_autocomplete():
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.delete(AUTOCOMPLETE_KEY)
+        for restaurant in collection_restaurants.find({}, {"name": 1, "menu._id": 1, "menu.name": 1}):
+            members = restaurant_autocomplete_members(restaurant)
+            if members:
+                pipe.zadd(AUTOCOMPLETE_KEY, {member: 0 for member in members})
+        pipe.execute()
+
+    # Sarasas atstatomas, jei Redis jo dar neturi (pvz. pirmas paleidimas)
+    if not redis_client.exists(AUTOCOMPLETE_KEY):
+        rebuild_autocomplete()
+
+    @app.cli.command("rebuild-autocomplete")
+    def rebuild_autocomplete_command():
+        """Rebuild the autocomplete names from the restaurants collection."""
+        rebuild_autocomplete()
+
+    # Restorano ID -> jo patiekalu ID (kai ORDER_MENU_CACHE ijungtas)
+    menu_ids_cache = {}
+
+    # Check that every order item's menu item exists in its restaurant. Each restaurant is
+    # fetched at most once, projected to its menu item ids. Returns an error response or None
+    def validate_order_items(items, use_cache=False):
+        wanted = {}
+        for item in items:
+            wanted.setdefault(item["restaurant_id"], set()).add(item["menu_item_id"])
+
+        use_cache = use_cache or app.config['ORDER_MENU_CACHE']
+        menu_ids = {}
+        if use_cache:
+            # Jei cache nezino kurio nors patiekalo (pvz. ka tik prideto) - restorana skaitome is naujo
+            for restaurant_id, ids in wanted.items():
+                cached = menu_ids_cache.get(restaurant_id)
+                if cached is not None and ids <= cached:
+                    menu_ids[restaurant_id] = cached
+
+        missing = [restaurant_id for restaurant_id in wanted if restaurant_id not in menu_ids]
+        if missing:
+            for restaurant in collection_restaurants.find({"_id": {"$in": missing}}, {"menu._id": 1}):
+                ids = frozenset(menu_item["_id"] for menu_item in restaurant.get("menu", []))
+                menu_ids[restaurant["_id"]] = ids
+                if use_cache:
+                    menu_ids_cache[restaurant["_id"]] = ids
+
+        # Klaidos pranesamos pagal pirma netinkama elementa, kaip ir anksciau
+        for item in items:
+            ids = menu_ids.get(item['restaurant_id'])
+            if ids is None:
+                return jsonify({"message": f"Restaurant with ID {item['restaurant_id']} not found"}), 404
+
+            if item['menu_item_id'] not in ids:
+                return jsonify({
+                    "message": f"Menu item ID {item['menu_item_id']} does not exist in restaurant {item['restaurant_id']}"
+                }), 400
+
+        return None
+
     # === PAVEIKSLELIO IKELIMAS ===
     def allowed_file(filename):
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+    # Procesu baseinas sukuriamas tik pirmo ikelimo metu; be Pillow miniaturos nekuriamos
+    thumbnail_executor = []
+
+    def thumbnail_path(filename, size):
+        return os.path.join(app.config['UPLOAD_FOLDER'], "thumbs", str(size), filename)
+
+    def schedule_thumbnails(filename):
+        if importlib.util.find_spec("PIL") is None:
+            return
+        if not thumbnail_executor:
+            thumbnail_executor.append(ProcessPoolExecutor(max_workers=app.config['THUMBNAIL_WORKERS']))
+
+        def log_failure(future):
+            if future.exception() is not None:
+                app.logger.warning("Thumbnail for %s failed: %s", filename, future.exception())
+
+        source = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        for size in app.config['THUMBNAIL_SIZES']:
+            if not os.path.exists(thumbnail_path(filename, size)):
+                thumbnail_executor[0].submit(make_thumbnail, source, thumbnail_path(filename, size), size).add_done_callback(log_failure)
+
     @app.route('/upload-image', methods=['POST'])
     def upload_image():
         if 'file' not in request.files:
@@ -73,13 +626,42 @@ def create_app():
             return jsonify({"error": "Invalid file type. Only .jpg, /jpeg, ad .png files are allowed"}), 400
         
         if file:
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)  # Ikeliamas paveikslelis i serveri
+            # allowed_file jau patikrino pletini; secure_filename gali pasalinti visa varda (pvz. "..png")
+            extension = file.filename.rsplit('.', 1)[1].lower()
+            if extension == "jpeg":
+                extension = "jpg"
+
+            # Failas rasomas i disko laikina faila dalimis, kartu skaiciuojant sha256
+            digest = hashlib.sha256()
+            fd, tmp_path = tempfile.mkstemp(dir=app.config['UPLOAD_FOLDER'], suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as tmp:
+                    for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b""):
+                        digest.update(chunk)
+                        tmp.write(chunk)
+
+                filename = f"{digest.hexdigest()}.{extension}"
+                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                # Toks pat turinys jau ikeltas - laikina faila ismetame
+                duplicate = os.path.exists(file_path)
+                if duplicate:
+                    os.remove(tmp_path)
+                else:
+                    os.replace(tmp_path, file_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            schedule_thumbnails(filename)
 
             # Graziname URL i paveiksleli
             image_url = f"http://localhost:8080/uploads/{filename}"
-            return jsonify({"message": "Image uploaded successfully!", "image_url": image_url}), 201
+            return jsonify({
+                "message": "Image uploaded successfully!",
+                "image_url": image_url,
+                "duplicate": duplicate
+            }), 201
 
     # ===== RESTORANAI =====
     @app.route('/restaurants', methods=['PUT'])
@@ -100,17 +682,68 @@ def create_app():
         }
 
         collection_restaurants.insert_one(restaurant)
+        index_restaurant(restaurant)
+        # Pavadinimas be zodziu (pvz. "!!!") neturi nariu
+        members = restaurant_autocomplete_members(restaurant)
+        if members:
+            redis_client.zadd(AUTOCOMPLETE_KEY, {member: 0 for member in members})
         return jsonify({"message": "Restaurant registered successfully!", "id": id}), 201
     
+    # List a collection ordered by _id. Arguments:
+    #   limit    - page size; without it the whole list is streamed from the cursor
+    #   after    - _id of the last document of the previous page
+    #   fields   - comma separated fields to return, e.g. fields=name,address
+    #   embedded - false leaves out the embedded array (menu, orders)
+    def list_documents(collection, embedded_field, not_found_message):
+        limit = request.args.get("limit", type=int)
+        if limit is not None:
+            limit = min(max(limit, 1), MAX_LIST_PAGE)
+        after = request.args.get("after")
+        fields = [field.strip() for field in request.args.get("fields", "").split(",") if field.strip()]
+        embedded = request.args.get("embedded", "true").lower() not in ("false", "0", "no")
+
+        if fields:
+            projection = {field: 1 for field in fields if embedded or field != embedded_field}
+            projection["_id"] = 1
+        elif not embedded:
+            projection = {embedded_field: 0}
+        else:
+            projection = None
+
+        cursor = collection.find({"_id": {"$gt": after}} if after else {}, projection).sort("_id", pymongo.ASCENDING)
+
+        if limit is not None:
+            documents = list(cursor.limit(limit))
+            if not documents and not after:
+                return jsonify({"message": not_found_message}), 404
+
+            response = jsonify(documents)
+            if len(documents) == limit:
+                args = request.args.to_dict()
+                args["after"] = documents[-1]["_id"]
+                response.headers["Link"] = f'<{url_for(request.endpoint, **args)}>; rel="next"'
+            return response, 200
+
+        # Pirmas dokumentas nuskaitomas pries atsakyma, kad tuscias sarasas galetu grazinti 404
+        first = next(cursor, None)
+        if first is None:
+            return jsonify({"message": not_found_message}), 404
+
+        def generate():
+            try:
+                yield "[" + app.json.dumps(first)
+                for document in cursor:
+                    yield "," + app.json.dumps(document)
+                yield "]"
+            finally:
+                cursor.close()
+
+        return Response(generate(), mimetype="application/json")
+
     @app.route('/restaurants', methods=['GET'])
     def get_restaurants():
         # Fetch restaurants from the collection
-        restaurants = list(collection_restaurants.find({}))
-        if restaurants:
-            # Return the JSON response
-            return jsonify(restaurants), 200
-        
-        return jsonify({"message": "No restaurants were found"}), 404
+        return list_documents(collection_restaurants, "menu", "No restaurants were found")
     
     @app.route('/restaurants/<restaurantId>', methods=['DELETE'])
     def del_restaurant(restaurantId):
@@ -118,6 +751,24 @@ def create_app():
 
         if restaurant:
             collection_restaurants.delete_one({"_id": restaurantId})
+            menu_ids_cache.pop(restaurantId, None)
+            unindex_restaurant(restaurantId)
+
+            # Istrinto restorano patiekalai pasalinami is populiarumo reitingu
+            menu_item_ids = [menu_item["_id"] for menu_item in restaurant.get("menu", [])]
+            pipe = redis_client.pipeline(transaction=False)
+            members = restaurant_autocomplete_members(restaurant)
+            if members:
+                pipe.zrem(AUTOCOMPLETE_KEY, *members)
+            pipe.incr(MENU_VERSION_KEY.format(restaurantId))
+            pipe.zrem(POPULAR_RESTAURANTS_KEY, restaurantId)
+            pipe.delete(POPULAR_RESTAURANT_KEY.format(restaurant_id=restaurantId),
+                        *redis_client.scan_iter(match=POPULAR_RESTAURANT_DAILY_KEY.format(restaurant_id=restaurantId, day="*")))
+            if menu_item_ids:
+                for key in [POPULAR_KEY, *redis_client.scan_iter(match=POPULAR_DAILY_KEY.format(day="*"))]:
+                    pipe.zrem(key, *menu_item_ids)
+                pipe.hdel(POPULAR_NAMES_KEY, *menu_item_ids)
+            pipe.execute()
             return jsonify({"message": "Restaurant deleted"}), 204
         else:
             return jsonify({"message": "Restaurant not found"}), 404
@@ -142,27 +793,80 @@ def create_app():
             "image_url": req["image_url"]   # Cia saugome paveikslelio URL
         }
 
-        collection_restaurants.update_one(
+        result = collection_restaurants.update_one(
             {"_id": restaurantId},
             {"$push": {"menu": menu_item}}
         )
+        if result.matched_count:
+            index_dish(restaurantId, menu_item)
+            members = autocomplete_members("dish", menu_item_id, menu_item["name"], restaurantId)
+            pipe = redis_client.pipeline(transaction=False)
+            if members:
+                pipe.zadd(AUTOCOMPLETE_KEY, {member: 0 for member in members})
+            pipe.incr(MENU_VERSION_KEY.format(restaurantId))
+            pipe.execute()
         return jsonify({"message": "Menu item added successfully!"}), 201
-    
+
+    # Version stamp of a restaurant's menu, used in the cache key and as the ETag
+    def menu_version(restaurant_id):
+        epoch, version = redis_client.mget(MENU_EPOCH_KEY, MENU_VERSION_KEY.format(restaurant_id))
+        return f"{int(epoch or 0)}.{int(version or 0)}"
+
     @app.route('/restaurants/<restaurantId>/menu', methods=['GET'])
     def get_menu(restaurantId):
-
-        restaurant = collection_restaurants.find_one({"_id": restaurantId})
-        if not restaurant:
-            return jsonify({"message": "Restaurant not found"}), 404
-        elif not restaurant["menu"]:
-            return jsonify({"message": "Menu not found"}), 404
-        
-        return jsonify(restaurant["menu"]), 200
+        # Jei kliento turima versija dar galioja - 304 be MongoDB ir be meniu cache
+        version = menu_version(restaurantId)
+        if request.if_none_match.contains(version):
+            response = app.response_class(status=304)
+        else:
+            cache_key = MENU_CACHE_KEY.format(restaurantId, version)
+            cached_menu = redis_client.get(cache_key)
+            if cached_menu is not None:
+                response = app.response_class(cached_menu, mimetype="application/json")
+            else:
+                restaurant = collection_restaurants.find_one({"_id": restaurantId}, {"menu": 1})
+                if not restaurant:
+                    return jsonify({"message": "Restaurant not found"}), 404
+                elif not restaurant["menu"]:
+                    return jsonify({"message": "Menu not found"}), 404
+
+                # Jei meniu pasikeite po versijos nuskaitymo, cache gaus naujesni meniu su senesne
+                # versija - tokio rakto niekas nebeskaitys
+                response = jsonify(restaurant["menu"])
+                redis_client.set(cache_key, response.get_data(), ex=app.config['MENU_CACHE_TTL'])
+
+        # Klientai ir tarpiniai serveriai turi pasitikrinti versija kiekviena karta
+        response.set_etag(version)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
     
     # ==== STATINIS PAVEIKSLELIO PATEIKIMAS ====
+    # ?size=N grazina maziausia ne mazesne uz N miniatiura; kol ji nesukurta - originala.
+    # Range ir If-None-Match apdoroja send_from_directory (conditional=True)
     @app.route('/uploads/<filename>', methods=['GET'])
     def serve_image(filename):
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+        match = IMAGE_NAME_RE.match(filename)
+        if not match:
+            # Senesni failai, ikelti pagal kliento failo varda
+            return send_from_directory(app.config['UPLOAD_FOLDER'], filename, conditional=True)
+
+        directory = app.config['UPLOAD_FOLDER']
+        # Stiprus ETag is turinio hash; miniaturos turi savo
+        etag = match.group(1)
+        size = request.args.get("size", type=int)
+        if size:
+            sizes = [s for s in sorted(app.config['THUMBNAIL_SIZES']) if s >= size]
+            if sizes and os.path.exists(thumbnail_path(filename, sizes[0])):
+                directory = os.path.dirname(thumbnail_path(filename, sizes[0]))
+                etag = f"{etag}-{sizes[0]}"
+            elif sizes:
+                # Miniatiura dar kuriama - originalo po siuo URL ilgai necache'uojame
+                return send_from_directory(directory, filename, conditional=True, etag=etag, max_age=0)
+
+        response = send_from_directory(directory, filename, conditional=True, etag=etag,
+                                       max_age=app.config['IMAGE_CACHE_MAX_AGE'])
+        response.cache_control.immutable = True
+        return response
     
     # ==== KLIENTAI ====
     @app.route('/customers', methods=['PUT'])
@@ -187,19 +891,14 @@ def create_app():
     @app.route('/customers', methods=['GET'])
     def get_customers():
         # Fetch customers from the collection
-        customers = list(collection_customers.find({}))
-        if customers:
-            # Return the JSON response
-            return jsonify(customers), 200
-        
-        return jsonify({"message": "No customers were found"}), 404
+        return list_documents(collection_customers, "orders", "No customers were found")
     
     @app.route('/customers/<customerId>', methods=['DELETE'])
     def del_customer(customerId):
-        customer = collection_customers.find_one({"_id": customerId})
+        result = collection_customers.delete_one({"_id": customerId})
 
-        if customer:
-            collection_customers.delete_one({"_id": customerId})
+        if result.deleted_count:
+            collection_orders.delete_many({"customer_id": customerId})
             return jsonify({"message": "Customer deleted"}), 204
         else:
             return jsonify({"message": "Customer not found"}), 404
@@ -232,70 +931,323 @@ def create_app():
             req["address"] = None # Default to None for clarity in storage
 
         for item in req['items']:
-            if 'restaurant_id' not in item or 'menu_item_id' not in item:
+            if not isinstance(item, dict) or 'restaurant_id' not in item or 'menu_item_id' not in item:
                 return jsonify({"message": "Each item must include 'restaurant_id' and 'menu_item_id'"}), 400
 
+            # ID grupuojami pagal restorana, todel jie turi buti eilutes
+            if not isinstance(item['restaurant_id'], str) or not isinstance(item['menu_item_id'], str):
+                return jsonify({"message": "'restaurant_id' and 'menu_item_id' must be strings"}), 400
+
             if 'quantity' not in item or not isinstance(item['quantity'], int) or item['quantity'] <= 0:
                 return jsonify({"message": "Each item must include valid 'quantity' greaten than 0"}), 400
 
-            restaurant = collection_restaurants.find_one({"_id": item['restaurant_id']})
-            if not restaurant:
-                return jsonify({"message": f"Restaurant with ID {item['restaurant_id']} not found"}), 404
+        if app.config['ORDER_QUEUE']:
+            return enqueue_order(customerId, req, order_type)
 
-            menu_item_exists = any(menu_item["_id"] == item['menu_item_id'] for menu_item in restaurant["menu"])
-            if not menu_item_exists:
-                return jsonify({
-                    "message": f"Menu item ID {item['menu_item_id']} does not exist in restaurant {item['restaurant_id']}"
-                }), 400
+        error = validate_order_items(req['items'])
+        if error:
+            return error
+
+        if not collection_customers.find_one({"_id": customerId}, {"_id": 1}):
+            return jsonify({"message": "Customer not found"}), 404
 
         id = get_next_sequence("order_id")
         
         # Build the order object
         order = {
             "_id": id,
+            "seq": int(id),
+            "customer_id": customerId,
             "items": req["items"],
             "order_type": order_type,
-            "address": req["address"]
+            "address": req["address"],
+            "created_at": datetime.now(timezone.utc)
         }
 
         # Insert the order into the database
-        result = collection_customers.update_one(
-            {"_id": customerId},
-            {"$push": {"orders": order}}
-        )
-        
-        if result.matched_count == 0:
-            return jsonify({"message": "Customer not found"}), 404
+        collection_orders.insert_one(order)
 
-        # Isvalome Redis cache siam klientui
-        redis_key = f"recommendations:{customerId}"
-        redis_client.delete(redis_key)
+        # Isvalome Redis cache siam klientui ir atnaujiname populiarumo reitingus - vienu kreipiniu
+        pipe = redis_client.pipeline(transaction=False)
+        order_stored(pipe, order)
+        pipe.execute()
 
         # Return success message with the order ID
         return jsonify({"message": "Order created successfully!", "order_id": id}), 201
 
+    # Queue the Redis updates that follow a newly stored order
+    def order_stored(pipe, order):
+        pipe.delete(f"recommendations:{order['customer_id']}")
+        count_popular_items(pipe, order["items"], order_day(order["created_at"]))
+
+    # ==== UZSAKYMU EILE ====
+    # Uzsakymu ID rezervuojami blokais: (paskutinis isduotas, paskutinis rezervuotas)
+    order_id_block = [0, 0]
+    order_id_lock = threading.Lock()
+
+    def next_order_id():
+        block_size = app.config['ORDER_ID_BLOCK_SIZE']
+        with order_id_lock:
+            if order_id_block[0] >= order_id_block[1]:
+                counter = collection_counters.find_one_and_update(
+                    {"_id": "order_id"},
+                    {"$inc": {"seq": block_size}},
+                    upsert=True,
+                    return_document=pymongo.ReturnDocument.AFTER
+                )
+                order_id_block[:] = [counter["seq"] - block_size, counter["seq"]]
+            order_id_block[0] += 1
+            return str(order_id_block[0])
+
+    # Validate against the cached menus, assign an ID and append the order to the stream.
+    # The customer is checked by the worker, the result is visible in the order status
+    def enqueue_order(customerId, req, order_type):
+        error = validate_order_items(req['items'], use_cache=True)
+        if error:
+            return error
+
+        id = next_order_id()
+        order = {
+            "_id": id,
+            "customer_id": customerId,
+            "items": req["items"],
+            "order_type": order_type,
+            "address": req["address"],
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.hset(ORDER_STATUS_KEY.format(id), mapping={"status": "queued"})
+        pipe.expire(ORDER_STATUS_KEY.format(id), app.config['ORDER_STATUS_TTL'])
+        pipe.xadd(ORDER_STREAM, {"order": json.dumps(order)})
+        pipe.execute()
+
+        return jsonify({
+            "message": "Order accepted",
+            "order_id": id,
+            "status_url": url_for("get_order_status", orderId=id)
+        }), 202
+
+    # Queue a stream entry on the dead-letter stream and mark its order as failed.
+    # The caller acknowledges and deletes the entry
+    def dead_letter_order(pipe, entry_id, fields, error):
+        pipe.xadd(ORDER_DEAD_LETTER_STREAM, {
+            "entry_id": entry_id,
+            "order": (fields or {}).get(b"order", b""),
+            "error": error
+        }, maxlen=ORDER_DEAD_LETTER_MAXLEN, approximate=True)
+        try:
+            order_id = json.loads(fields[b"order"])["_id"]
+        except (KeyError, TypeError, ValueError):
+            return
+        if isinstance(order_id, str):
+            status_key = ORDER_STATUS_KEY.format(order_id)
+            pipe.hset(status_key, mapping={"status": "failed", "message": "Order could not be stored"})
+            pipe.expire(status_key, app.config['ORDER_STATUS_TTL'])
+
+    # Write a batch of stream entries to MongoDB. Orders are upserted by _id, so entries
+    # delivered again after a crash don't create duplicates or count twice in the rankings.
+    # Malformed entries are moved to the dead-letter stream
+    def store_queued_orders(entries):
+        orders = []
+        malformed = []
+        for entry_id, fields in entries:
+            # Istrinti irasai (fields = None) tik patvirtinami
+            if fields:
+                try:
+                    order = json.loads(fields[b"order"])
+                    if not isinstance(order.get("_id"), str) or not isinstance(order.get("customer_id"), str) \
+                            or not isinstance(order.get("items"), list):
+                        raise ValueError("_id, customer_id or items missing or of a wrong type")
+                    order["seq"] = int(order["_id"])
+                    order["created_at"] = datetime.fromisoformat(order["created_at"])
+                except (AttributeError, KeyError, TypeError, ValueError) as e:
+                    malformed.append((entry_id, fields, f"Malformed order entry: {e}"))
+                    continue
+                orders.append(order)
+
+        customer_ids = list({order["customer_id"] for order in orders})
+        existing = {customer["_id"] for customer in collection_customers.find({"_id": {"$in": customer_ids}}, {"_id": 1})}
+        valid = [order for order in orders if order["customer_id"] in existing]
+
+        inserted = set()
+        if valid:
+            result = collection_orders.bulk_write([
+                pymongo.UpdateOne(
+                    {"_id": order["_id"]},
+                    {"$setOnInsert": {key: value for key, value in order.items() if key != "_id"}},
+                    upsert=True
+                )
+                for order in valid
+            ], ordered=False)
+            inserted = set(result.upserted_ids.values())
+
+        pipe = redis_client.pipeline(transaction=False)
+        for order in orders:
+            status_key = ORDER_STATUS_KEY.format(order["_id"])
+            if order["customer_id"] in existing:
+                pipe.hset(status_key, mapping={"status": "stored"})
+                if order["_id"] in inserted:
+                    order_stored(pipe, order)
+            else:
+                pipe.hset(status_key, mapping={"status": "failed", "message": "Customer not found"})
+            pipe.expire(status_key, app.config['ORDER_STATUS_TTL'])
+        for entry_id, fields, error in malformed:
+            app.logger.warning("Order entry %s moved to %s: %s", entry_id, ORDER_DEAD_LETTER_STREAM, error)
+            dead_letter_order(pipe, entry_id, fields, error)
+        entry_ids = [entry_id for entry_id, _ in entries]
+        pipe.xack(ORDER_STREAM, ORDER_GROUP, *entry_ids)
+        pipe.xdel(ORDER_STREAM, *entry_ids)
+        pipe.execute()
+
+    # Store entries; if a batch fails for a reason other than a connection problem the
+    # entries are tried one by one, and an entry failing ORDER_MAX_ATTEMPTS times on its
+    # own is dead-lettered. Other failures are raised so the worker backs off and retries
+    def store_order_entries(entries, failures):
+        try:
+            store_queued_orders(entries)
+            for entry_id, _ in entries:
+                failures.pop(entry_id, None)
+        except TRANSIENT_ORDER_ERRORS:
+            raise
+        except Exception as e:
+            if len(entries) > 1:
+                for entry in entries:
+                    store_order_entries([entry], failures)
+                return
+
+            entry_id, fields = entries[0]
+            failures[entry_id] = failures.get(entry_id, 0) + 1
+            if failures[entry_id] < app.config['ORDER_MAX_ATTEMPTS']:
+                raise
+            del failures[entry_id]
+
+            app.logger.error("Order entry %s moved to %s after %d attempts: %s",
+                             entry_id, ORDER_DEAD_LETTER_STREAM, app.config['ORDER_MAX_ATTEMPTS'], e)
+            pipe = redis_client.pipeline(transaction=True)
+            dead_letter_order(pipe, entry_id, fields, f"{type(e).__name__}: {e}")
+            pipe.xack(ORDER_STREAM, ORDER_GROUP, entry_id)
+            pipe.xdel(ORDER_STREAM, entry_id)
+            pipe.execute()
+
+    def order_worker(consumer, batch_size, block_ms, stop):
+        # Pirmiausia - sio darbininko gauti, bet nepatvirtinti irasai (pvz. po perkrovimo)
+        stream_id = "0"
+        failures = {} # stream iraso ID -> nepavykusiu bandymu skaicius
+        delay = ORDER_WORKER_MIN_BACKOFF
+        while not stop.is_set():
+            try:
+                response = redis_client.xreadgroup(ORDER_GROUP, consumer, {ORDER_STREAM: stream_id},
+                                                   count=batch_size, block=block_ms)
+                entries = response[0][1] if response else []
+
+                if not entries:
+                    if stream_id == "0":
+                        stream_id = ">"
+                        continue
+                    # Perimame irasus darbininku, kurie juos gavo, bet seniai nepatvirtino
+                    entries = redis_client.xautoclaim(ORDER_STREAM, ORDER_GROUP, consumer,
+                                                      min_idle_time=app.config['ORDER_CLAIM_IDLE_MS'],
+                                                      count=batch_size)[1]
+                if entries:
+                    store_order_entries(entries, failures)
+                delay = ORDER_WORKER_MIN_BACKOFF
+            except Exception:
+                app.logger.exception("Order worker %s failed, retrying in %.1f s", consumer, delay)
+                # Nepatvirtinti irasai liko sio darbininko sarase - perskaitysime juos is naujo
+                stream_id = "0"
+                stop.wait(delay)
+                delay = min(delay * 2, ORDER_WORKER_MAX_BACKOFF)
+
+    @app.cli.command("order-workers")
+    @click.option("--workers", default=4, show_default=True)
+    @click.option("--batch-size", default=100, show_default=True)
+    @click.option("--name", default=lambda: f"worker-{os.getpid()}", help="Consumer name prefix.")
+    def order_workers_command(workers, batch_size, name):
+        """Write queued orders from the Redis Stream to MongoDB."""
+        try:
+            redis_client.xgroup_create(ORDER_STREAM, ORDER_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=order_worker, args=(f"{name}-{i}", batch_size, 1000, stop), daemon=True)
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        click.echo(f"Started {workers} order workers")
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(1)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    @app.route('/orders/<orderId>/status', methods=['GET'])
+    def get_order_status(orderId):
+        status = redis_client.hgetall(ORDER_STATUS_KEY.format(orderId))
+        if status:
+            return jsonify({"order_id": orderId, **{key.decode(): value.decode() for key, value in status.items()}}), 200
+
+        # Sinchroniskai sukurti ir seniai irasyti uzsakymai
+        if collection_orders.find_one({"_id": orderId}, {"_id": 1}):
+            return jsonify({"order_id": orderId, "status": "stored"}), 200
+
+        return jsonify({"message": "Order not found"}), 404
+
+    # Orders of a customer, newest first. With `limit` only that many, with `before` only
+    # orders with a smaller ID. Orders not yet moved from customers.orders are included
+    def find_customer_orders(customer, limit=None, before=None):
+        query = {"customer_id": customer["_id"]}
+        if before is not None:
+            query["seq"] = {"$lt": before}
+        cursor = collection_orders.find(query).sort("seq", pymongo.DESCENDING)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        orders = list(cursor)
+
+        legacy = [order for order in customer.get("orders", []) if before is None or int(order["_id"]) < before]
+        if legacy:
+            moved = {order["_id"] for order in orders}
+            orders += [order for order in legacy if order["_id"] not in moved]
+            orders.sort(key=lambda order: int(order["_id"]), reverse=True)
+            if limit is not None:
+                orders = orders[:limit]
+        return orders
+
     @app.route('/customers/<customerId>/orders', methods=['GET'])
     def get_order(customerId):
-        # Fetch orders for the specified customer ID
-        customer = collection_customers.find_one({"_id": customerId})
+        # Puslapiavimas: limit - uzsakymu skaicius, before - paskutinio matyto uzsakymo ID
+        limit = request.args.get("limit", type=int)
+        if limit is not None:
+            limit = min(max(limit, 1), MAX_ORDERS_PAGE)
+        before = request.args.get("before", type=int)
+
+        # Is kliento dokumento imami tik dar neperkelti uzsakymai
+        customer = collection_customers.find_one({"_id": customerId}, {"orders": 1})
 
         if not customer:
             return jsonify({"message": "Customer not found"}), 404
-        elif not customer["orders"]:
+
+        orders = find_customer_orders(customer, limit=limit, before=before)
+
+        if not orders and before is None:
             return jsonify({"message": "No orders were found for this customer"}), 404
 
+        restaurant_names, menu_items = load_order_items([item for order in orders for item in order["items"]])
+
         enriched_orders = []
-        for order in customer.get("orders", []):
+        for order in orders:
             enriched_items = []
             total_price = 0
             for item in order["items"]:
-                # Surandame restorana pagal ID
-                restaurant = collection_restaurants.find_one({"_id": item["restaurant_id"]})
-                # Surandame patiekala pagal ID
-                menu_item = next(
-                    (m for m in restaurant["menu"] if m["_id"] == item["menu_item_id"]),
-                    None
-                )
+                restaurant_name = restaurant_names.get(item["restaurant_id"])
+                menu_item = menu_items.get((item["restaurant_id"], item["menu_item_id"]))
 
                 # Jei patiekalas rastas, prideti jo kaina prie bendros sumos
                 if menu_item and "price" in menu_item:
@@ -304,7 +1256,7 @@ def create_app():
                 # Praturtiname elementa pavadinimais
                 enriched_items.append({
                     "restaurant_id": item["restaurant_id"],
-                    "restaurant_name": restaurant["name"] if restaurant else "Unknown",
+                    "restaurant_name": restaurant_name if restaurant_name is not None else "Unknown",
                     "menu_item_id": item["menu_item_id"],
                     "menu_item_name": menu_item["name"] if menu_item else "Unknown",
                     "quantity": item["quantity"]
@@ -319,150 +1271,259 @@ def create_app():
             })
 
         # Return the list of orders
-        return jsonify(enriched_orders), 200
+        response = jsonify(enriched_orders)
+        if limit is not None and len(orders) == limit:
+            next_url = url_for(request.endpoint, customerId=customerId, limit=limit, before=orders[-1]["_id"])
+            response.headers["Link"] = f'<{next_url}>; rel="next"'
+        return response, 200
 
     # ==== REKOMENDACIJOS ====
+    # Build the recommendations of a customer, None if the customer doesn't exist
+    def compute_recommendations(customerId):
+        # Is kliento dokumento reikia tik paskutinio dar neperkelto uzsakymo
+        customer = collection_customers.find_one({"_id": customerId}, {"orders": {"$slice": -1}})
+        if not customer:
+            return None
+
+        pipeline = [{"$match": {"customer_id": customerId}}]   # Filtruojame pagal klienta
+        if customer.get("orders"):
+            # Kol uzsakymai perkeliami, pridedami ir likusieji customers.orders (be pasikartojanciu)
+            pipeline += [
+                {"$unionWith": {"coll": collection_customers.name, "pipeline": [
+                    {"$match": {"_id": customerId}},
+                    {"$unwind": "$orders"},
+                    {"$replaceRoot": {"newRoot": "$orders"}}
+                ]}},
+                {"$group": {"_id": "$_id", "items": {"$first": "$items"}}}
+            ]
+        pipeline += [
+            {"$unwind": "$items"},             # Isskirstome patiekalus uzsakymuose
+            {"$group": {
+                "_id": "$items.menu_item_id",
+                "count": {"$sum": 1}           # Skaiciuojame, kiek kartu patiekalas uzsakytas
+            }},
+            {"$sort": {"count": -1}},         # Rikiavimas mazejancia tvarka
+            {"$limit": 3}                      # Imame tik 3 populiariausius patiekalus
+        ]
+
+        popular_dishes = list(collection_orders.aggregate(pipeline))
+
+        # Paskutinis uzsakymas
+        last_orders = find_customer_orders(customer, limit=1)
+        last_order_items = last_orders[0]["items"] if last_orders else []
+
+        # Visi reikalingi patiekalai ir ju restoranai gaunami viena uzklausa
+        menu_items = find_menu_items([dish["_id"] for dish in popular_dishes] +
+                                     [item["menu_item_id"] for item in last_order_items])
+
+        # Sukuriame rekomendaciju sarasa su papildoma informacija
+        recommendations = []
+        for dish in popular_dishes:
+            if dish["_id"] in menu_items:
+                _, restaurant_name, menu_item = menu_items[dish["_id"]]
+                recommendations.append({
+                    "menu_item_id": menu_item["_id"],
+                    "menu_item_name": menu_item["name"],
+                    "restaurant_name": restaurant_name,
+                    "popularity": dish["count"]
+                })
+
+        last_order_details = []
+        for item in last_order_items:
+            if item["menu_item_id"] in menu_items:
+                _, restaurant_name, menu_item = menu_items[item["menu_item_id"]]
+                last_order_details.append({
+                    "menu_item_id": menu_item["_id"],
+                    "menu_item_name": menu_item["name"],
+                    "restaurant_name": restaurant_name,
+                    "quantity": item["quantity"]
+                })
+
+        # Sukuriame rekomendaciju atsakyma
+        return {
+            "order_again": last_order_details,
+            "popular_dishes": recommendations
+        }
+
     @app.route('/recomendations/<customerId>', methods=['GET'])
     def get_recommendations(customerId):
         try:
-            # Redis raktas pagal klienta
+            # Redis raktas pagal klienta. Naujas uzsakymas istrina tik redis_key, sena reiksme lieka stale_key
             redis_key = f"recommendations:{customerId}"
+            stale_key = f"{redis_key}:stale"
 
             # Tirkriname Redis cache
             cached_data = redis_client.get(redis_key)
             if cached_data:
-                return jsonify(eval(cached_data)), 200
-
-            # Jei duomenu nera cache, atliekame MongoDB uzklausa
-            customer = collection_customers.find_one({"_id": customerId})
-            if not customer:
-                return jsonify({"message": "Customer not found"}), 404
-            
-            pipeline = [
-                {"$match": {"_id": customerId}},   # Filtruojame pagal klienta
-                {"$unwind": "$orders"},            # Kiekviena uzsakyma atskiriame
-                {"$unwind": "$orders.items"},      # Isskirstome patiekalus uzsakymuose
-                {"$group": {
-                    "_id": "$orders.items.menu_item_id",
-                    "count": {"$sum": 1}           # Skaiciuojame, kiek kartu patiekalas uzsakytas
-                }},
-                {"$sort": {"count": -1}},         # Rikiavimas mazejancia tvarka
-                {"$limit": 3}                      # Imame tik 3 populiariausius patiekalus
-            ]
-
-            popular_dishes = list(collection_customers.aggregate(pipeline))
+                return jsonify(json.loads(cached_data)), 200
+
+            # Rekomendacijas skaiciuoja tik uzrakta gaves procesas. Kiti grazina sena reiksme,
+            # o jei jos nera - laukia uzrakto ir skaito jo savininko rezultata
+            lock = redis_client.lock(f"{redis_key}:lock", timeout=app.config['RECOMMENDATIONS_LOCK_TIMEOUT'])
+            if not lock.acquire(blocking=False):
+                stale_data = redis_client.get(stale_key)
+                if stale_data:
+                    return jsonify(json.loads(stale_data)), 200
+                if not lock.acquire(blocking=True, blocking_timeout=app.config['RECOMMENDATIONS_LOCK_TIMEOUT']):
+                    lock = None
+
+            try:
+                cached_data = redis_client.get(redis_key)
+                if cached_data:
+                    return jsonify(json.loads(cached_data)), 200
+
+                # Jei duomenu nera cache, atliekame MongoDB uzklausa
+                response = compute_recommendations(customerId)
+                if response is None:
+                    return jsonify({"message": "Customer not found"}), 404
+
+                jitter = app.config['RECOMMENDATIONS_TTL_JITTER']
+                ttl = max(1, int(app.config['RECOMMENDATIONS_TTL'] * random.uniform(1 - jitter, 1 + jitter)))
+                data = json.dumps(response, separators=(",", ":"))
+
+                pipe = redis_client.pipeline()
+                pipe.set(redis_key, data, ex=ttl)
+                pipe.set(stale_key, data, ex=app.config['RECOMMENDATIONS_STALE_TTL'])
+                pipe.execute()
+
+                return jsonify(response), 200
+            finally:
+                if lock is not None:
+                    try:
+                        lock.release()
+                    except LockError:
+                        # Uzraktas jau nustojo galioti
+                        pass
 
-            # Sukuriame rekomendaciju sarasa su papildoma informacija
-            recommendations = []
-            for dish in popular_dishes:
-                menu_item_id = dish["_id"]
-                count = dish["count"]
-
-                # Randame restorana ir patiekala pagal menu_item_id
-                restaurant = collection_restaurants.find_one(
-                    {"menu._id": menu_item_id}, {"name": 1, "menu.$": 1}
-                )
-
-                if restaurant:
-                    menu_item = restaurant["menu"][0]
-                    recommendations.append({
-                        "menu_item_id": menu_item["_id"],
-                        "menu_item_name": menu_item["name"],
-                        "restaurant_name": restaurant["name"],
-                        "popularity": count
-                    })
-            
-            # Paskutinis uzsakymas
-            last_order = customer["orders"][-1] if customer["orders"] else None
-
-            if last_order:
-                last_order_items = last_order["items"]
-                last_order_details = []
-                for item in last_order_items:
-                    menu_item_id = item["menu_item_id"]
-
-                    # Randame restorana ir patiekala pagal menu_item_id
-                    restaurant = collection_restaurants.find_one(
-                        {"menu._id": menu_item_id}, {"name": 1, "menu.$": 1}
-                    )
-
-                    if restaurant:
-                        menu_item = restaurant["menu"][0]
-                        last_order_details.append({
-                            "menu_item_id": menu_item["_id"],
-                            "menu_item_name": menu_item["name"],
-                            "restaurant_name": restaurant["name"],
-                            "quantity": item["quantity"]
-                        })
-
-            last_order = last_order_details
-
-            # Sukuriame rekomendaciju atsakyma
-            response = {
-                "order_again": last_order,
-                "popular_dishes": recommendations
-            }
-
-            # Issaugome rezultata Redis (be TTL)
-            redis_client.set(redis_key, str(response))
-
-            return jsonify(response), 200
-        
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+    # ==== POPULIARIAUSI PATIEKALAI ====
+    @app.route('/popular', methods=['GET'])
+    def get_popular_dishes():
+        return popular_response(POPULAR_KEY, lambda day: POPULAR_DAILY_KEY.format(day=day))
+
+    @app.route('/restaurants/<restaurantId>/popular', methods=['GET'])
+    def get_restaurant_popular_dishes(restaurantId):
+        return popular_response(POPULAR_RESTAURANT_KEY.format(restaurant_id=restaurantId),
+                                lambda day: POPULAR_RESTAURANT_DAILY_KEY.format(restaurant_id=restaurantId, day=day))
+
     @app.route('/search', methods=['GET'])
     def search_menu():
         query = request.args.get('query', '').strip()
         if not query:
             return jsonify({"message": "Query parameter ir required"}), 400
 
-        # Ieskome restoranu ir patiekalu naudojant tekstini indeksa
-        search_results = list(
-            collection_restaurants.find(
-                {"$text": {"$search": query}}, # Naudojame $text operatoriu
-                {"score": {"$meta": "textScore"}, "name": 1, "menu": 1, "address": 1, "working_hours": 1}
-            ).sort([("score", {"$meta": "textScore"})]) # Rusiuojame pagal tekstinio atitikimo bala
-        )
+        offset = max(request.args.get("offset", 0, type=int), 0)
+        limit = min(max(request.args.get("limit", DEFAULT_SEARCH_LIMIT, type=int), 1), MAX_SEARCH_LIMIT)
+
+        # Patiekalai reitinguojami BM25 pagal pavadinima ir aprasyma
+        ranked_dishes = dish_index.search(query)
 
-        # Atidalijame rezultatus i restoranus ir patiekalus
-        restaurant_results = []
         dish_results = []
+        for dish_id, score in ranked_dishes[offset:offset + limit]:
+            dish = search_dishes.get(dish_id)
+            restaurant = search_restaurants.get(dish["restaurant_id"]) if dish else None
+            if not restaurant:
+                continue
+            dish_results.append({
+                "restaurant_id": str(dish["restaurant_id"]),
+                "restaurant_name": restaurant["name"],
+                "dish_id": dish_id,
+                "dish_name": dish.get("name"),
+                "description": dish.get("description", ""),
+                "price": dish.get("price", 0),
+                "score": round(score, 4)
+            })
 
-        for restaurant in search_results:
-            # Pridedame restorana prie rezultatu
+        # Restoranas tinka, jei tinka jo pavadinimas arba kuris nors patiekalas;
+        # jo balas - geresnis is siu dvieju
+        restaurant_scores = dict(restaurant_index.search(query))
+        for dish_id, score in ranked_dishes:
+            dish = search_dishes.get(dish_id)
+            if dish and score > restaurant_scores.get(dish["restaurant_id"], 0):
+                restaurant_scores[dish["restaurant_id"]] = score
+        ranked_restaurants = heapq.nlargest(offset + limit, restaurant_scores.items(), key=lambda item: item[1])
+
+        restaurant_results = []
+        for restaurant_id, score in ranked_restaurants[offset:]:
+            restaurant = search_restaurants.get(restaurant_id)
+            if not restaurant:
+                continue
             restaurant_results.append({
-                "restaurant_id": str(restaurant["_id"]),
+                "restaurant_id": str(restaurant_id),
                 "name": restaurant["name"],
-                "address": restaurant.get("address", ""),
-                "working_hours": restaurant.get("working_hours", "")
+                "address": restaurant["address"],
+                "working_hours": restaurant["working_hours"],
+                "score": round(score, 4)
             })
 
-        # Pridedame patiekalus prie rezultatu
-        for dish in restaurant.get("menu", []):
-            if query.lower() in (dish.get("name", "").lower() + " " + dish.get("description", "").lower()):
-                dish_results.append({
-                    "restaurant_id": str(restaurant["_id"]),
-                    "restaurant_name": restaurant["name"],
-                    "dish_id": dish.get("_id"),
-                    "dish_name": dish.get("name"),
-                    "description": dish.get("description", ""),
-                    "price": dish.get("price", 0)
-                })
-
         # Graziname rezultatus kaip strukturuota JSON atsakyma
         return jsonify({
             "restaurants": restaurant_results,
-            "dishes": dish_results
+            "dishes": dish_results,
+            "restaurants_total": len(restaurant_scores),
+            "dishes_total": len(ranked_dishes)
         }), 200
         
+    # Restaurant and dish names starting with `prefix` (from any word), most popular first.
+    # type=restaurant|dish limits the results to one kind.
+    # Only the first AUTOCOMPLETE_SCAN matching names in alphabetical order are ranked, so for
+    # a short prefix matching more names a popular name later in the alphabet can be missing
+    @app.route('/autocomplete', methods=['GET'])
+    def autocomplete():
+        prefix = " ".join(tokenize(request.args.get('prefix', '')))
+        if not prefix:
+            return jsonify({"message": "prefix parameter is required"}), 400
+        kind = request.args.get('type')
+        if kind not in (None, "restaurant", "dish"):
+            return jsonify({"message": "type must be 'restaurant' or 'dish'"}), 400
+        limit = min(max(request.args.get("limit", DEFAULT_AUTOCOMPLETE_LIMIT, type=int), 1), MAX_AUTOCOMPLETE_LIMIT)
+
+        prefix = prefix.encode()
+        members = redis_client.zrangebylex(AUTOCOMPLETE_KEY, b"[" + prefix, b"[" + prefix + b"\xff",
+                                           start=0, num=app.config['AUTOCOMPLETE_SCAN'])
+
+        # Tas pats pavadinimas gali atitikti nuo keliu zodziu
+        matches = {}
+        for member in members:
+            match_kind, id, name, restaurant_id = json.loads(member.split(b"\x00", 1)[1])
+            if kind is None or match_kind == kind:
+                matches[(match_kind, id)] = (name, restaurant_id)
+        if not matches:
+            return jsonify([]), 200
+
+        # Populiarumas - uzsakytu patiekalu (ar restorano patiekalu) kiekis
+        pipe = redis_client.pipeline(transaction=False)
+        for match_kind, id in matches:
+            pipe.zscore(POPULAR_RESTAURANTS_KEY if match_kind == "restaurant" else POPULAR_KEY, id)
+        scores = pipe.execute()
+
+        ranked = sorted(zip(matches.items(), scores), key=lambda match: (-(match[1] or 0), match[0][1][0].lower()))
+        results = []
+        for ((match_kind, id), (name, restaurant_id)), score in ranked[:limit]:
+            result = {"type": match_kind, "id": id, "name": name, "popularity": int(score or 0)}
+            if match_kind == "dish":
+                result["restaurant_id"] = restaurant_id
+            results.append(result)
+        return jsonify(results), 200
+
     @app.route('/cleanup', methods=['POST'])
     def clear_database():
         # Isvalome visus duomenis is kolekciju
         try:
             collection_restaurants.delete_many({})
             collection_customers.delete_many({})
+            collection_orders.delete_many({})
             collection_counters.delete_many({})
+            menu_ids_cache.clear()
+            order_id_block[:] = [0, 0]
+            rebuild_search_index()
+            keys = popular_keys()
+            if keys:
+                redis_client.delete(*keys)
+            redis_client.delete(AUTOCOMPLETE_KEY)
+            redis_client.incr(MENU_EPOCH_KEY)
             
             # Inicialize counters after cleanup
             initialize_counters()
@@ -1,8 +1,118 @@
+import json
+import threading
+import time
 import pymongo
 import werkzeug
-from flask import (Flask, request, jsonify, abort)
+from flask import (Flask, Response, request, jsonify, abort, stream_with_context)
 from collections import OrderedDict
 
+# Kiek NDJSON eiluciu irasome vienu bulk_write
+IMPORT_CHUNK_SIZE = 1000
+
+# Grazinama is ProductCache.get, kai produkto cache nera
+MISSING = object()
+
+# MongoDB klaidos kodas (IllegalOperation), kai transakcijos nepalaikomos - atskiras serveris be replica set
+TRANSACTIONS_NOT_SUPPORTED = 20
+
+
+class ProductCache:
+    """Bounded LRU of product documents keyed by product id.
+
+    Unknown ids are cached as None for `negative_ttl` seconds, so repeated
+    misses don't reach Mongo. If a Redis client is given it is used as a
+    shared second level behind the in-process LRU. Invalidations only reach
+    this process and Redis, so with Redis the in-process entries expire after
+    `local_ttl` seconds and other processes see a change within that time.
+    """
+
+    def __init__(self, max_size=10000, negative_ttl=5, redis_client=None, redis_ttl=3600, local_ttl=5):
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.redis_client = redis_client
+        self.redis_ttl = redis_ttl
+        # Be Redis cache yra tik siame procese, todel jo irasai nesensta
+        self.local_ttl = local_ttl if redis_client is not None else None
+        self._entries = OrderedDict() # product id -> (product or None, expires_at or None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _redis_key(self, product_id):
+        return f"product_cache:{product_id}"
+
+    def _local_expiry(self):
+        return time.monotonic() + self.local_ttl if self.local_ttl is not None else None
+
+    def _store(self, product_id, product, expires_at):
+        with self._lock:
+            self._entries[product_id] = (product, expires_at)
+            self._entries.move_to_end(product_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Returns the product, None for a cached miss, or MISSING if nothing is cached
+    def get(self, product_id):
+        with self._lock:
+            entry = self._entries.get(product_id)
+            if entry is not None:
+                product, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(product_id)
+                    self.hits += 1
+                    return product
+                del self._entries[product_id]
+
+        if self.redis_client is not None:
+            cached = self.redis_client.get(self._redis_key(product_id))
+            if cached is not None:
+                product = json.loads(cached)
+                expires_at = self._local_expiry() if product is not None else time.monotonic() + self.negative_ttl
+                self._store(product_id, product, expires_at)
+                with self._lock:
+                    self.hits += 1
+                return product
+
+        with self._lock:
+            self.misses += 1
+        return MISSING
+
+    def put(self, product):
+        self._store(product["_id"], product, self._local_expiry())
+        if self.redis_client is not None:
+            self.redis_client.set(self._redis_key(product["_id"]), json.dumps(product), ex=self.redis_ttl)
+
+    def put_missing(self, product_id):
+        self._store(product_id, None, time.monotonic() + self.negative_ttl)
+        if self.redis_client is not None:
+            self.redis_client.set(self._redis_key(product_id), "null", ex=self.negative_ttl)
+
+    def invalidate(self, product_id):
+        with self._lock:
+            self._entries.pop(product_id, None)
+        if self.redis_client is not None:
+            self.redis_client.delete(self._redis_key(product_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.redis_client is not None:
+            keys = list(self.redis_client.scan_iter(match=self._redis_key("*")))
+            if keys:
+                self.redis_client.delete(*keys)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxSize": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
 
 def create_app():
     app = Flask(__name__)
@@ -13,6 +123,29 @@ def create_app():
     collection_warehouses = db["warehouses"]
     collection_products = db["products"]
     collection_counters = db["counters"] # New collection for counters
+    collection_category_stats = db["product_category_stats"] # Produktu statistika pagal kategorija
+
+    # Indeksas kategorijos min/max perskaiciavimui
+    collection_products.create_index("category")
+
+    # Produktu cache, pasirinktinai su Redis kaip bendru antru lygiu
+    app.config.setdefault("PRODUCT_CACHE_SIZE", 10000)
+    app.config.setdefault("PRODUCT_CACHE_NEGATIVE_TTL", 5)
+    app.config.setdefault("PRODUCT_CACHE_REDIS_URL", None)
+    # Su Redis: kiek sekundziu produktas laikomas proceso atmintyje, kol vel tikrinamas Redis
+    app.config.setdefault("PRODUCT_CACHE_LOCAL_TTL", 5)
+
+    cache_redis_client = None
+    if app.config["PRODUCT_CACHE_REDIS_URL"]:
+        import redis
+        cache_redis_client = redis.Redis.from_url(app.config["PRODUCT_CACHE_REDIS_URL"])
+
+    product_cache = ProductCache(
+        max_size=app.config["PRODUCT_CACHE_SIZE"],
+        negative_ttl=app.config["PRODUCT_CACHE_NEGATIVE_TTL"],
+        redis_client=cache_redis_client,
+        local_ttl=app.config["PRODUCT_CACHE_LOCAL_TTL"]
+    )
 
     # Initialize the counters collection if it doesn't exist
     def initialize_counters():
@@ -25,6 +158,84 @@ def create_app():
 
     initialize_counters()
 
+    # Rebuild the per-category statistics from the products collection
+    def rebuild_category_stats():
+        pipeline = [
+            {
+                "$group": {
+                    "_id": "$category",
+                    "count": {"$sum": 1},
+                    "totalPrice": {"$sum": "$price"},
+                    "minPrice": {"$min": "$price"},
+                    "maxPrice": {"$max": "$price"}
+                }
+            },
+            {"$out": collection_category_stats.name}
+        ]
+        collection_products.aggregate(pipeline)
+
+    # Statistika dar nesukurta, bet produktu jau yra
+    if collection_category_stats.estimated_document_count() == 0 \
+            and collection_products.estimated_document_count() > 0:
+        rebuild_category_stats()
+
+    @app.cli.command("rebuild-category-stats")
+    def rebuild_category_stats_command():
+        """Rebuild product statistics by category."""
+        rebuild_category_stats()
+
+    # Add newly inserted products to the per-category statistics
+    def add_to_category_stats(products):
+        by_category = {}
+        for product in products:
+            stats = by_category.setdefault(product.get("category"), {
+                "count": 0, "totalPrice": 0, "minPrice": product["price"], "maxPrice": product["price"]
+            })
+            stats["count"] += 1
+            stats["totalPrice"] += product["price"]
+            stats["minPrice"] = min(stats["minPrice"], product["price"])
+            stats["maxPrice"] = max(stats["maxPrice"], product["price"])
+
+        operations = [
+            pymongo.UpdateOne(
+                {"_id": category},
+                {
+                    "$inc": {"count": stats["count"], "totalPrice": stats["totalPrice"]},
+                    "$min": {"minPrice": stats["minPrice"]},
+                    "$max": {"maxPrice": stats["maxPrice"]}
+                },
+                upsert=True
+            )
+            for category, stats in by_category.items()
+        ]
+        if operations:
+            collection_category_stats.bulk_write(operations, ordered=False)
+
+    # Remove a deleted product from the per-category statistics
+    def remove_from_category_stats(product):
+        category = product.get("category")
+        stats = collection_category_stats.find_one_and_update(
+            {"_id": category},
+            {"$inc": {"count": -1, "totalPrice": -product["price"]}},
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        if not stats:
+            return
+
+        if stats["count"] <= 0:
+            collection_category_stats.delete_one({"_id": category, "count": {"$lte": 0}})
+        elif product["price"] <= stats["minPrice"] or product["price"] >= stats["maxPrice"]:
+            # Min/max negalima sumazinti su $inc, perskaiciuojame tik sios kategorijos produktams
+            result = list(collection_products.aggregate([
+                {"$match": {"category": category}},
+                {"$group": {"_id": None, "minPrice": {"$min": "$price"}, "maxPrice": {"$max": "$price"}}}
+            ]))
+            if result:
+                collection_category_stats.update_one(
+                    {"_id": category},
+                    {"$set": {"minPrice": result[0]["minPrice"], "maxPrice": result[0]["maxPrice"]}}
+                )
+
     # Function to get the next sequence value unique id
     def get_next_sequence(counter_id):
         sequence = collection_counters.find_one_and_update(
@@ -34,7 +245,111 @@ def create_app():
             return_document=pymongo.ReturnDocument.AFTER
         )
         return str(sequence["seq"]) # Return as a string
-    
+
+    # Reserve a block of sequence values in one round trip, returns the first one
+    def reserve_sequence_block(counter_id, count):
+        sequence = collection_counters.find_one_and_update(
+            {"_id": counter_id},
+            {"$inc": {"seq": count}},
+            upsert = True,
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        return sequence["seq"] - count + 1
+
+    # Read-through product lookup
+    def get_product(product_id):
+        product = product_cache.get(product_id)
+        if product is not MISSING:
+            return product
+
+        product = collection_products.find_one({"_id": product_id})
+        if product:
+            product_cache.put(product)
+        else:
+            product_cache.put_missing(product_id)
+        return product
+
+    # Read-through lookup of many products, cache misses are loaded with one $in query
+    def get_products(product_ids):
+        products = {}
+        missing_ids = []
+        for product_id in product_ids:
+            product = product_cache.get(product_id)
+            if product is MISSING:
+                missing_ids.append(product_id)
+            elif product:
+                products[product_id] = product
+
+        if missing_ids:
+            for product in collection_products.find({"_id": {"$in": missing_ids}}):
+                product_cache.put(product)
+                products[product["_id"]] = product
+            for product_id in missing_ids:
+                if product_id not in products:
+                    product_cache.put_missing(product_id)
+
+        return products
+
+    # capacity yra visa sandelio talpa, laisva talpa - capacity atemus inventoriaus kiekiu suma
+    def warehouse_free_capacity(warehouse):
+        return warehouse["capacity"] - sum(item["quantity"] for item in warehouse.get("inventory", []))
+
+    # Atomically push items into a warehouse inventory if they fit in its free capacity.
+    # Returns the updated warehouse (capacity and inventory quantities), or None if it
+    # doesn't exist or has too little free capacity
+    def reserve_inventory(warehouse_id, items, session=None):
+        total_quantity = sum(item["quantity"] for item in items)
+        return collection_warehouses.find_one_and_update(
+            {
+                "_id": warehouse_id,
+                "$expr": {"$lte": [{"$add": [{"$sum": "$inventory.quantity"}, total_quantity]}, "$capacity"]}
+            },
+            {"$push": {"inventory": {"$each": items}}},
+            projection={"capacity": 1, "inventory.quantity": 1},
+            return_document=pymongo.ReturnDocument.AFTER,
+            session=session
+        )
+
+    # Parse an NDJSON request body line by line, without loading it into memory
+    def iter_ndjson(stream):
+        for line_no, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_no, None, "Invalid JSON"
+                continue
+            if not isinstance(row, dict):
+                yield line_no, None, "Row must be a JSON object"
+                continue
+            yield line_no, row, None
+
+    # Split parsed rows into chunks of IMPORT_CHUNK_SIZE
+    def iter_chunks(rows):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def ndjson_line(data):
+        return json.dumps(data) + "\n"
+
+    # Same checks as register_product, returns an error message or None
+    def validate_product(row):
+        if 'name' not in row or 'price' not in row:
+            return "Invalid input, missing name or price"
+        if not isinstance(row['price'], (int, float)) or isinstance(row['price'], bool) or row['price'] <= 0:
+            return "Price must be a positive number"
+        if not isinstance(row.get('category'), (str, type(None))):
+            return "Category must be a string"
+        return None
+
     # Register a new product
     @app.route('/products', methods=['PUT'])
     def register_product():
@@ -57,9 +372,11 @@ def create_app():
                 "category": req["category"]
             }
             collection_products.insert_one(product)
+            product_cache.put(product)
+            add_to_category_stats([product])
             return jsonify({"message": "Product registered", "id": id}), 201
         else:
-            existing_product = collection_products.find_one({"_id": str(req['id'])})
+            existing_product = get_product(str(req['id']))
             if existing_product:
                 return jsonify({"message": "Product ID already exists"}), 400
             product = {
@@ -69,6 +386,8 @@ def create_app():
                 "category": req['category']
             }
             collection_products.insert_one(product)
+            product_cache.put(product)
+            add_to_category_stats([product])
             return jsonify({"message": "Product registered", "id": str(req['id'])}), 201
 
     # List all products, optionally in a category
@@ -99,7 +418,7 @@ def create_app():
     @app.route('/products/<productId>', methods=['GET'])
     def get_product_details(productId):
         # Ieskome produkto pagal pateikta ID
-        product = collection_products.find_one({"_id": productId})
+        product = get_product(productId)
         # Jei produktas rastas, graziname informacija apie ji
         if product:
             # Pasirenkame tik reikiamus laukus
@@ -113,13 +432,80 @@ def create_app():
         else:
             return jsonify({"message": "Product not found"}), 404
 
+    # Import products from an NDJSON body, one product per line
+    @app.route('/products:import', methods=['POST'])
+    def import_products():
+        stream = request.stream
+
+        def generate():
+            imported = 0
+            failed = 0
+            for chunk in iter_chunks(iter_ndjson(stream)):
+                products = []
+                lines = []
+                for line_no, row, error in chunk:
+                    if error is None:
+                        error = validate_product(row)
+                    if error:
+                        failed += 1
+                        yield ndjson_line({"line": line_no, "message": error})
+                        continue
+                    products.append({
+                        "_id": str(row["id"]) if 'id' in row else None,
+                        "name": row["name"],
+                        "price": row["price"],
+                        "category": row.get("category")
+                    })
+                    lines.append(line_no)
+
+                # Naujus ID rezervuojame vienu kartu visam gabalui
+                missing_ids = [product for product in products if product["_id"] is None]
+                if missing_ids:
+                    next_id = reserve_sequence_block("product_id", len(missing_ids))
+                    for offset, product in enumerate(missing_ids):
+                        product["_id"] = str(next_id + offset)
+
+                if not products:
+                    continue
+
+                write_errors = {}
+                inserted = []
+                try:
+                    collection_products.bulk_write(
+                        [pymongo.InsertOne(product) for product in products], ordered=False
+                    )
+                except pymongo.errors.BulkWriteError as e:
+                    for write_error in e.details.get("writeErrors", []):
+                        write_errors[write_error["index"]] = write_error
+
+                for index, line_no in enumerate(lines):
+                    if index in write_errors:
+                        failed += 1
+                        if write_errors[index].get("code") == 11000:
+                            message = "Product ID already exists"
+                        else:
+                            message = write_errors[index].get("errmsg", "Write failed")
+                        yield ndjson_line({"line": line_no, "message": message})
+                    else:
+                        product_cache.put(products[index])
+                        inserted.append(products[index])
+                        imported += 1
+
+                add_to_category_stats(inserted)
+
+            yield ndjson_line({"imported": imported, "failed": failed})
+
+        return Response(stream_with_context(generate()), status=200, mimetype="application/x-ndjson")
+
     # Delete product
     @app.route('/products/<productId>', methods=['DELETE'])
     def delete_product(productId):
         product = collection_products.find_one({"_id": productId})
         if product:
             result = collection_products.delete_one({"_id": productId})
+            product_cache.invalidate(productId)
             if result.deleted_count > 0:
+                remove_from_category_stats(product)
                 return jsonify({"message": "Product deleted"}), 204
             else:
                 return jsonify({"message": "Product not fount"}), 404
@@ -184,21 +570,16 @@ def create_app():
         if 'productId' not in req or 'quantity' not in req:
             return jsonify({"message": "Invalid input, missing productId or quantity"}), 400
         
-        # Patikriname, ar nurodytas sandelis egzistuoja
-        warehouse = collection_warehouses.find_one({"_id": warehouseId})
-        if not warehouse:
-            return jsonify({"message": "Warehouse not found"}), 404
-        
+        # Patikriname, kad idedamos prekes kiekis butu teigiamas skaicius
+        requested_quantity = req['quantity']
+        if not isinstance(requested_quantity, int) or requested_quantity <= 0:
+            return jsonify({"message": "Quantity must be a positive integer and less or equal to warehouse capacity"}), 400    
+
         # Patikriname, ar nurodytas produktas egzistuoja
-        product = collection_products.find_one({"_id": req['productId']})
+        product = get_product(req['productId'])
         if not product:
             return jsonify({"message": "Product not found"}), 404
         
-        # Patikriname, kad idedamos prekes kiekis nevirsytu sandelio talpos ir butu teigiamas skaicius
-        requested_quantity = req['quantity']
-        if not isinstance(requested_quantity, int) or requested_quantity <= 0 or requested_quantity >= warehouse["capacity"]:
-            return jsonify({"message": "Quantity must be a positive integer and less or equal to warehouse capacity"}), 400    
-        
         # Sugeneruojamas inventoriaus ID
         inventory_item_id = get_next_sequence("inventory_id")
         
@@ -209,18 +590,94 @@ def create_app():
             "quantity": requested_quantity
         }
             
-        # Update sandelio dokumenta, kad pridetume inventoriu ir sumazintume sandelio talpa
-        new_capacity = warehouse["capacity"] - requested_quantity
-        collection_warehouses.update_one(
-            {"_id": warehouseId},
-            {
-                #"$set": {"capacity": new_capacity},   
-                "$push": {"inventory": new_invetory_item}
-            }
-        )
+        # Viena salygine operacija patikriname laisva talpa ir pridedame inventoriu,
+        # todel lygiagretus uzklausos negali virsyti talpos
+        warehouse = reserve_inventory(warehouseId, [new_invetory_item])
+        if not warehouse:
+            # Papildoma uzklausa tik klaidos atveju - sandelio nera ar nepakanka talpos
+            if not collection_warehouses.find_one({"_id": warehouseId}, {"_id": 1}):
+                return jsonify({"message": "Warehouse not found"}), 404
+            return jsonify({"message": "Quantity must be a positive integer and less or equal to warehouse capacity"}), 400
 
         return jsonify({"message": "Product added to inventory", "id": inventory_item_id}), 201
 
+    # Import inventory items from an NDJSON body, one {productId, quantity} per line
+    @app.route('/warehouses/<warehouseId>/inventory:import', methods=['POST'])
+    def import_inventory(warehouseId):
+        warehouse = collection_warehouses.find_one({"_id": warehouseId}, {"capacity": 1, "inventory.quantity": 1})
+        if not warehouse:
+            return jsonify({"message": "Warehouse not found"}), 404
+
+        stream = request.stream
+
+        def generate():
+            imported = 0
+            failed = 0
+            remaining_capacity = warehouse_free_capacity(warehouse)
+            for chunk in iter_chunks(iter_ndjson(stream)):
+                # Visus gabalo produktus patikriname viena uzklausa
+                product_ids = {row["productId"] for _, row, error in chunk
+                               if error is None and isinstance(row.get("productId"), str)}
+                existing_products = get_products(product_ids)
+
+                items = []
+                lines = []
+                for line_no, row, error in chunk:
+                    if error is None:
+                        if 'productId' not in row or 'quantity' not in row:
+                            error = "Invalid input, missing productId or quantity"
+                        elif not isinstance(row['productId'], str):
+                            error = "productId must be a string"
+                        elif row['productId'] not in existing_products:
+                            error = "Product not found"
+                        elif not isinstance(row['quantity'], int) or isinstance(row['quantity'], bool) \
+                                or row['quantity'] <= 0:
+                            error = "Quantity must be a positive integer and less or equal to warehouse capacity"
+                    if error:
+                        failed += 1
+                        yield ndjson_line({"line": line_no, "message": error})
+                        continue
+                    items.append({"productId": row["productId"], "quantity": row["quantity"]})
+                    lines.append(line_no)
+
+                if not items:
+                    continue
+
+                next_id = reserve_sequence_block("inventory_id", len(items))
+                for offset, item in enumerate(items):
+                    item["_id"] = str(next_id + offset)
+
+                # Inventorius yra sandelio dokumento masyvas, todel visas gabalas - vienas salyginis $push.
+                # Jei talpa lygiagreciai pasikeite, perskaitome ja ir bandome su tilpusiais elementais
+                while items:
+                    accepted_items = []
+                    accepted_lines = []
+                    free_capacity = remaining_capacity
+                    for item, line_no in zip(items, lines):
+                        if item["quantity"] <= free_capacity:
+                            accepted_items.append(item)
+                            accepted_lines.append(line_no)
+                            free_capacity -= item["quantity"]
+                        else:
+                            failed += 1
+                            yield ndjson_line({"line": line_no, "message": "Not enough warehouse capacity"})
+                    items, lines = accepted_items, accepted_lines
+                    if not items:
+                        break
+
+                    updated = reserve_inventory(warehouseId, items)
+                    if updated:
+                        remaining_capacity = warehouse_free_capacity(updated)
+                        imported += len(items)
+                        break
+
+                    current = collection_warehouses.find_one({"_id": warehouseId}, {"capacity": 1, "inventory.quantity": 1})
+                    remaining_capacity = warehouse_free_capacity(current) if current else 0
+
+            yield ndjson_line({"imported": imported, "failed": failed})
+
+        return Response(stream_with_context(generate()), status=200, mimetype="application/x-ndjson")
+
     # Get inventory of products in warehouse
     @app.route('/warehouses/<warehouseId>/inventory', methods=['GET'])
     def get_inventory(warehouseId):
@@ -259,21 +716,93 @@ def create_app():
         if not inventory_item:
             return jsonify({"message": "Inventory not found"}), 404
         
-        # Atstatome sandelio talpa, pridedami salinamame inventoriaus elemente esanciu produktu kieki
-        new_capacity = warehouse["capacity"] + inventory_item["quantity"]
-
-        # Pasaliname inventoriaus elementa
+        # Pasaliname inventoriaus elementa, laisva talpa skaiciuojama is inventoriaus
         collection_warehouses.update_one(
             {"_id": warehouseId},
-            {
-                #"$set": {"capacity": new_capacity},
-                "$pull": {"inventory": {"_id": inventoryId}}
-            }
+            {"$pull": {"inventory": {"_id": inventoryId}}}
         )
 
         return jsonify({"message": "Product removed from inventory"}), 204
         
 
+    # Ar serveris palaiko transakcijas (replica set / mongos), nustatoma per pirma perkelima
+    transactions_supported = [True]
+
+    # Move inventory items to another warehouse.
+    # On a standalone server the destination is reserved first and the source is updated
+    # only if it still holds every item, otherwise the reservation is undone
+    @app.route('/warehouses/<warehouseId>/transfer', methods=['POST'])
+    def transfer_inventory(warehouseId):
+        req = request.get_json()
+
+        # Patikriname, ar nurodyti reikalingi laukai
+        if not req or 'destinationId' not in req or 'inventoryIds' not in req:
+            return jsonify({"message": "Invalid input, missing destinationId or inventoryIds"}), 400
+
+        inventory_ids = req['inventoryIds']
+        if not isinstance(inventory_ids, list) or not inventory_ids \
+                or not all(isinstance(inventory_id, str) for inventory_id in inventory_ids):
+            return jsonify({"message": "inventoryIds must be a non-empty list of inventory IDs"}), 400
+
+        destination_id = str(req['destinationId'])
+        if destination_id == warehouseId:
+            return jsonify({"message": "Source and destination warehouses must be different"}), 400
+
+        inventory_ids = list(dict.fromkeys(inventory_ids)) # Pasaliname pasikartojancius ID
+
+        # Visas perkelimas: vienas saltinio skaitymas, vienas salyginis paskirties atnaujinimas
+        # (talpos patikrinimas) ir vienas saltinio atnaujinimas. Su session - vienoje transakcijoje
+        def transfer(session=None):
+            source = collection_warehouses.find_one({"_id": warehouseId}, {"inventory": 1}, session=session)
+            if not source:
+                return jsonify({"message": "Warehouse not found"}), 404
+
+            wanted_ids = set(inventory_ids)
+            source_items = {item["_id"]: item for item in source["inventory"] if item["_id"] in wanted_ids}
+            missing_ids = [inventory_id for inventory_id in inventory_ids if inventory_id not in source_items]
+            if missing_ids:
+                return jsonify({"message": "Inventory not found", "inventoryIds": missing_ids}), 404
+
+            items = [source_items[inventory_id] for inventory_id in inventory_ids]
+            if not reserve_inventory(destination_id, items, session=session):
+                if not collection_warehouses.find_one({"_id": destination_id}, {"_id": 1}, session=session):
+                    return jsonify({"message": "Destination warehouse not found"}), 404
+                return jsonify({"message": "Not enough capacity in destination warehouse"}), 400
+
+            # Be transakcijos salyga ant inventory._id uztikrina, kad elementai vis dar saltinyje
+            pulled = collection_warehouses.update_one(
+                {"_id": warehouseId, "inventory._id": {"$all": inventory_ids}},
+                {"$pull": {"inventory": {"_id": {"$in": inventory_ids}}}},
+                session=session
+            )
+            if not pulled.matched_count:
+                # Kita uzklausa spejo pakeisti saltinio inventoriu - atsaukiame paskirties rezervacija
+                collection_warehouses.update_one(
+                    {"_id": destination_id},
+                    {"$pull": {"inventory": {"_id": {"$in": inventory_ids}}}},
+                    session=session
+                )
+                return jsonify({"message": "Inventory was changed by another request, try again"}), 409
+            return jsonify({"message": "Inventory transferred", "inventoryIds": inventory_ids}), 200
+
+        def transfer_in_transaction(session):
+            response, status = transfer(session)
+            if status != 200:
+                session.abort_transaction()
+            return response, status
+
+        if transactions_supported[0]:
+            try:
+                with client.start_session() as session:
+                    return session.with_transaction(transfer_in_transaction)
+            except pymongo.errors.OperationFailure as e:
+                if e.code != TRANSACTIONS_NOT_SUPPORTED:
+                    raise
+                # Atskiras serveris: toliau perkeliame be transakcijos
+                transactions_supported[0] = False
+
+        return transfer()
+
     # Get total value of products in warehouse
     @app.route('/warehouses/<warehouseId>/value', methods=['GET'])
     def get_warehouse_value(warehouseId):
@@ -330,21 +859,17 @@ def create_app():
     def get_warehouse_capacity():
         # Aggregation pipeline
         pipeline = [
+            {
+                "$project": {
+                    "capacity": 1,
+                    "usedCapacity": {"$sum": "$inventory.quantity"}  # Sum quantities of items in inventory
+                }
+            },
             {
                 "$group": {
                     "_id": None,  # Grupuojami visi dokumentai kartu
                     "totalCapacity": {"$sum": "$capacity"},  # Visu sandeliu talpu suma
-                    "usedCapacity": {
-                        "$sum": {
-                            "$sum": {
-                                 "$reduce": {
-                                    "input": {"$ifNull": ["$inventory", []]},  # If inventory is null, use empty array
-                                    "initialValue": 0,
-                                    "in": {"$add": ["$$value", "$$this.quantity"]}  # Sum quantities of items in inventory
-                                }
-                            }
-                        }
-                    }
+                    "usedCapacity": {"$sum": "$usedCapacity"}
                 }
             },
             {
@@ -353,7 +878,7 @@ def create_app():
                     "totalCapacity": 1,
                     "usedCapacity": 1,
                     "freeCapacity": {
-                        "$subtract": ["$totalCapacity", "$usedCapacity"]      
+                        "$subtract": ["$totalCapacity", "$usedCapacity"]
                     }
                 }
             }
@@ -375,27 +900,24 @@ def create_app():
     # Get statistics on product categories
     @app.route('/statistics/products/by/category', methods=['GET'])
     def product_category_stats():
-        # Aggregation pipeline
-        pipeline = [
-            {
-                "$group": {
-                    "_id": "$category", # Grupuojama pagal kategorija
-                    "count": {"$sum": 1} # Susaiciuojamas kiekvienos kategorijos produktu skaicius
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0, # Isvestyje nereikalingas _id laukas
-                    "category": "$_id", # Pervardiname _id lauka i category
-                    "count": 1 # Itraukiame count lauka
-                }
-            }
-        ]
-
-        result = list(collection_products.aggregate(pipeline))
+        # Statistika palaikoma register_product ir delete_product, todel uztenka vieno skaitymo
+        result = []
+        for stats in collection_category_stats.find({}).sort("_id"):
+            result.append({
+                "category": stats["_id"], # Kategorija saugoma _id lauke
+                "count": stats["count"],
+                "totalPrice": stats["totalPrice"],
+                "minPrice": stats["minPrice"],
+                "maxPrice": stats["maxPrice"]
+            })
 
         return jsonify(result), 200
 
+    # Get product cache metrics
+    @app.route('/statistics/cache/products', methods=['GET'])
+    def product_cache_stats():
+        return jsonify(product_cache.stats()), 200
+
     # # Clear the database
     @app.route('/cleanup', methods=['POST'])
     def clear_database():
@@ -404,6 +926,8 @@ def create_app():
             collection_products.delete_many({})
             collection_warehouses.delete_many({})
             collection_counters.delete_many({})
+            collection_category_stats.delete_many({})
+            product_cache.clear()
             
             # Inicialize counters after cleanup
             initialize_counters()
@@ -1,12 +1,994 @@
+import csv
+import heapq
+import itertools
+import json
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
 import werkzeug
-from flask import (Flask, request, jsonify, abort)
+import click
+from flask import (Flask, Response, request, jsonify, abort, stream_with_context, url_for)
 from py2neo import Graph
+from py2neo.errors import (TransientError, ConnectionUnavailable, ConnectionBroken,
+                           ConnectionLimit, ServiceUnavailable)
 
-graph = Graph("bolt://localhost:7687", auth=("neo4j", "newpassword"))
+# Klaidos, po kuriu transakcija kartojama
+RETRYABLE_ERRORS = (TransientError, ConnectionUnavailable, ConnectionBroken, ServiceUnavailable)
+
+# Skrydziu paieska neieskos marsrutu su daugiau persedimu
+MAX_STOPS = 3
+DEFAULT_ROUTE_LIMIT = 5
+MAX_ROUTE_LIMIT = 50
+
+# Didziausias miestu ir oro uostu sarasu puslapis
+MAX_PAGE_SIZE = 1000
+
+
+# Unikalumo apribojimai ir indeksai. IF NOT EXISTS leidzia juos vykdyti kiekvieno paleidimo metu
+SCHEMA_STATEMENTS = [
+    "CREATE CONSTRAINT city_name_country IF NOT EXISTS FOR (c:City) REQUIRE (c.name, c.country) IS UNIQUE",
+    "CREATE CONSTRAINT airport_code IF NOT EXISTS FOR (a:Airport) REQUIRE a.code IS UNIQUE",
+    "CREATE CONSTRAINT flight_number IF NOT EXISTS FOR (f:Flight) REQUIRE f.number IS UNIQUE",
+    "CREATE INDEX city_name IF NOT EXISTS FOR (c:City) ON (c.name)",
+    "CREATE INDEX city_country IF NOT EXISTS FOR (c:City) ON (c.country)",
+    "CREATE INDEX airport_name IF NOT EXISTS FOR (a:Airport) ON (a.name)",
+    "CREATE INDEX flies_to_number IF NOT EXISTS FOR ()-[r:FLIES_TO]-() ON (r.number)",
+    "CREATE CONSTRAINT graph_version_name IF NOT EXISTS FOR (v:GraphVersion) REQUIRE v.name IS UNIQUE",
+]
+
+# Marsrutu grafo versija, bendra visiems procesams, kai Redis nenaudojamas
+GRAPH_VERSION_READ_QUERY = """
+OPTIONAL MATCH (v:GraphVersion {name: 'routes'})
+RETURN coalesce(v.value, 0) AS value
+"""
+GRAPH_VERSION_BUMP_QUERY = """
+MERGE (v:GraphVersion {name: 'routes'})
+SET v.value = coalesce(v.value, 0) + 1
+RETURN v.value AS value
+"""
+
+
+def bootstrap_schema(graph, logger):
+    """Create the schema, logging statements that fail instead of raising.
+
+    A constraint cannot be created while existing data violates it (e.g.
+    duplicate flight numbers). That must not make every request fail, so
+    such statements are skipped; connection errors are still raised so the
+    next request tries to connect again.
+    """
+    for statement in SCHEMA_STATEMENTS:
+        try:
+            graph.run(statement)
+        except RETRYABLE_ERRORS + (ConnectionLimit,):
+            raise
+        except Exception as e:
+            logger.warning("Schema statement failed: %s: %s", statement, e)
+
+
+class Database:
+    """Lazily connected py2neo Graph with managed read and write transactions.
+
+    The Graph (and its connection pool) is only created on first use, so the
+    app can start while Neo4j is down. At most `max_connections` transactions
+    run at once; a caller waits up to `acquisition_timeout` seconds for a slot
+    and then gets ConnectionLimit. Transactions failing with a transient or
+    connection error are retried until `max_retry_time` seconds have passed.
+    """
+
+    def __init__(self, uri, auth, max_connections=100, max_connection_age=3600,
+                 acquisition_timeout=60, max_retry_time=15):
+        self.uri = uri
+        self.auth = auth
+        self.max_connections = max_connections
+        self.max_connection_age = max_connection_age
+        self.acquisition_timeout = acquisition_timeout
+        self.max_retry_time = max_retry_time
+        self._graph = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._on_connect = []
+
+    def on_connect(self, callback):
+        """Run `callback(graph)` once, before the first transaction."""
+        self._on_connect.append(callback)
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            with self._lock:
+                if self._graph is None:
+                    graph = Graph(self.uri, auth=self.auth, max_size=self.max_connections,
+                                  max_age=self.max_connection_age)
+                    for callback in self._on_connect:
+                        callback(graph)
+                    self._graph = graph
+        return self._graph
+
+    def _run(self, work, readonly, max_retry_time):
+        if max_retry_time is None:
+            max_retry_time = self.max_retry_time
+        deadline = time.monotonic() + max_retry_time
+        delay = 0.1
+        while True:
+            if not self._slots.acquire(timeout=self.acquisition_timeout):
+                raise ConnectionLimit("Timed out waiting for a free database connection")
+            tx = None
+            try:
+                tx = self.graph.begin(readonly=readonly)
+                result = work(tx)
+                self.graph.commit(tx)
+                return result
+            except RETRYABLE_ERRORS:
+                if tx is not None:
+                    self.graph.rollback(tx)
+                if time.monotonic() + delay > deadline:
+                    raise
+            except Exception:
+                if tx is not None:
+                    self.graph.rollback(tx)
+                raise
+            finally:
+                self._slots.release()
+            time.sleep(delay)
+            delay = min(delay * 2, 1)
+
+    def read(self, work, max_retry_time=None):
+        """Run `work(tx)` in a read transaction and return its result."""
+        return self._run(work, True, max_retry_time)
+
+    def write(self, work, max_retry_time=None):
+        """Run `work(tx)` in a write transaction and return its result."""
+        return self._run(work, False, max_retry_time)
+
+    def read_data(self, query, **parameters):
+        return self.read(lambda tx: tx.run(query, **parameters).data())
+
+    def write_data(self, query, **parameters):
+        return self.write(lambda tx: tx.run(query, **parameters).data())
+
+    def stream(self, query, **parameters):
+        """Yield the records of a read query as dicts while its cursor is consumed.
+
+        The transaction stays open until the generator is exhausted or closed.
+        It is not retried, since part of the records may already have been sent.
+        """
+        if not self._slots.acquire(timeout=self.acquisition_timeout):
+            raise ConnectionLimit("Timed out waiting for a free database connection")
+        tx = None
+        try:
+            tx = self.graph.begin(readonly=True)
+            for record in tx.run(query, **parameters):
+                yield dict(record)
+            self.graph.commit(tx)
+        except BaseException:
+            # BaseException - ir GeneratorExit, kai klientas nutraukia rysi
+            if tx is not None:
+                self.graph.rollback(tx)
+            raise
+        finally:
+            self._slots.release()
+
+
+class QueryBatch:
+    """Independent read queries sent to Neo4j as one statement (one round trip).
+
+    Every query runs in its own CALL subquery whose rows are collected into a
+    list inside it, so each subquery yields exactly one row and a query
+    without results gives an empty list instead of hiding the others. All returned
+    columns must be named with AS. Parameters are renamed per query, so the
+    queries may use the same parameter names.
+
+        batch = QueryBatch()
+        batch.add("MATCH (c:City {name: $name}) RETURN c.name AS name", name=name)
+        batch.add("MATCH (a:Airport {code: $code}) RETURN a.name AS name", code=code)
+        cities, airports = db.read(batch.run)
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.parameters = {}
+
+    def add(self, query, **parameters):
+        prefix = f"b{len(self.queries)}_"
+        query = re.sub(r"\$(\w+)", lambda m: "$" + prefix + m.group(1), query)
+        # Stulpeliai imami is paskutinio RETURN iki ORDER BY / SKIP / LIMIT
+        returned = re.split(r"\bRETURN\b", query, flags=re.I)[-1]
+        returned = re.split(r"\b(?:ORDER\s+BY|SKIP|LIMIT)\b", returned, flags=re.I)[0]
+        columns = re.findall(r"\bAS\s+(\w+)\s*(?=,|$)", returned.strip(), flags=re.I)
+        if not columns:
+            raise ValueError("Batched query columns must be named with AS")
+        self.queries.append((query, columns))
+        self.parameters.update({prefix + key: value for key, value in parameters.items()})
+
+    def statement(self):
+        clauses = []
+        results = []
+        for i, (query, columns) in enumerate(self.queries):
+            row = ", ".join(f"{column}: {column}" for column in columns)
+            # collect() be grupavimo raktu grazina viena eilute ir tusciam rezultatui
+            clauses.append("CALL { CALL {" + query + "} RETURN " + f"collect({{{row}}}) AS _batch{i} }}")
+            results.append(f"_batch{i}")
+        clauses.append("RETURN " + ", ".join(results))
+        return "\n".join(clauses)
+
+    def run(self, tx):
+        """Run the batch in `tx` and return a list of rows for every query, in order."""
+        record = tx.run(self.statement(), **self.parameters).data()[0]
+        return [record[f"_batch{i}"] for i in range(len(self.queries))]
+
+
+# Skrydziai rasomi UNWIND paketais. Jei kurio nors oro uosto nera - eilutes rezultate nebus,
+# jei skrydis su tokiu numeriu jau yra - created = false.
+# Salia Flight mazgo kuriamas ir tiesioginis (Airport)-[:FLIES_TO]->(Airport) rysys paieskai
+FLIGHT_WRITE_QUERY = """
+UNWIND $rows AS row
+MATCH (from:Airport {code: row.fromAirport}), (to:Airport {code: row.toAirport})
+MERGE (f:Flight {number: row.number})
+ON CREATE SET f.price = row.price, f.flightTimeInMinutes = row.flightTimeInMinutes, f.operator = row.operator,
+              f._created = true
+WITH row, from, to, f, f._created IS NOT NULL AS created
+REMOVE f._created
+FOREACH (_ IN CASE WHEN created THEN [1] ELSE [] END |
+    CREATE (from)-[:HAS_FLIGHT]->(f)-[:GOES_TO]->(to)
+    CREATE (from)-[:FLIES_TO {number: row.number, price: row.price,
+                              flightTimeInMinutes: row.flightTimeInMinutes, operator: row.operator}]->(to))
+RETURN row.line AS line, created
+"""
+
+# FLIES_TO rysiu sukurimas skrydziams, registruotiems pries ju atsiradima
+FLIES_TO_BACKFILL_QUERY = """
+UNWIND $numbers AS number
+MATCH (from:Airport)-[:HAS_FLIGHT]->(f:Flight {number: number})-[:GOES_TO]->(to:Airport)
+MERGE (from)-[r:FLIES_TO {number: f.number}]->(to)
+ON CREATE SET r.price = f.price, r.flightTimeInMinutes = f.flightTimeInMinutes, r.operator = f.operator
+"""
+
+FLIGHT_FIELDS = ("number", "fromAirport", "toAirport", "price", "flightTimeInMinutes", "operator")
+DEFAULT_FLIGHT_IMPORT_BATCH_SIZE = 1000
+
+
+def parse_flight_rows(lines, fmt="ndjson"):
+    """Yield (line number, flight row, error) for each NDJSON or CSV line."""
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            try:
+                row["price"] = _number(float(row["price"])) if row.get("price") else None
+                row["flightTimeInMinutes"] = _number(float(row["flightTimeInMinutes"])) if row.get("flightTimeInMinutes") else None
+            except ValueError:
+                yield reader.line_num, None, "price and flightTimeInMinutes must be numbers"
+                continue
+            yield reader.line_num, row, None
+        return
+
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_no, None, "Invalid JSON"
+            continue
+        if not isinstance(row, dict):
+            yield line_no, None, "Row must be a JSON object"
+            continue
+        yield line_no, row, None
+
+
+def _number(value):
+    # Sumos skaiciuojamos float masyvuose, sveikas reiksmes graziname kaip int
+    return int(value) if float(value).is_integer() else value
+
+
+def _positive_number(value):
+    """Return `value` as a positive int or float, or raise ValueError."""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("not a number")
+    number = float(value)
+    if not math.isfinite(number) or number <= 0:
+        raise ValueError("not a positive number")
+    return _number(number)
+
+
+def validate_flight(row):
+    """Check a flight row (dict with FLIGHT_FIELDS) and convert its price and
+    flight time to numbers in place. Returns an error message or None."""
+    if not all(row.get(field) for field in FLIGHT_FIELDS):
+        return "Flight could not be created due to missing data"
+    # JSON reiksmes gali buti bet kokio tipo, o oro uostu kodai ir skrydziu numeriai - eilutes
+    if not all(isinstance(row[field], str) for field in ("number", "fromAirport", "toAirport", "operator")):
+        return "number, fromAirport, toAirport and operator must be strings"
+    try:
+        row["price"] = _positive_number(row["price"])
+        row["flightTimeInMinutes"] = _positive_number(row["flightTimeInMinutes"])
+    except ValueError:
+        return "price and flightTimeInMinutes must be positive numbers"
+    return None
+
+
+class RouteEngine:
+    """In-memory flight graph used by the route search.
+
+    Airports are numbered in load order. Flights are kept in parallel arrays
+    indexed by flight number order, and `adjacency[i]` holds the indexes of
+    the flights leaving airport i. `version` is bumped on every change.
+
+    `reach[k][i]` is a bitset (int) of the airports reachable from airport i
+    with at most k stops. It is kept up to date when single flights are added,
+    rebuilt in a background thread after a load or a bulk import, and is None
+    while such a rebuild is pending.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.loaded = False
+        self.version = 0
+        self._reach_thread = None
+        self._reset()
+
+    def _reset(self):
+        self.cities = set()
+        self.city_airports = {} # miesto pavadinimas -> oro uostu indeksai
+        self.airport_codes = []
+        self.airport_index = {}
+        self.adjacency = []
+        self.flight_index = {}
+        self.flight_numbers = []
+        self.flight_operators = []
+        self.flight_from = array('i')
+        self.flight_to = array('i')
+        self.flight_price = array('d')
+        self.flight_time = array('d')
+        self.reach = None
+
+    def load(self, cities, airports, flights):
+        """Replace the graph with (name) cities, (code, city) airports and
+        (number, from, to, price, minutes, operator) flights. Flights with
+        a non-numeric price or time are skipped, their numbers are returned.
+        The engine is marked loaded only after the whole graph was added."""
+        with self._lock:
+            self._reset()
+            self.loaded = False
+            skipped = []
+            try:
+                for name in cities:
+                    self._add_city(name)
+                for code, city in airports:
+                    self._add_airport(code, city)
+                for flight in flights:
+                    try:
+                        self._add_flight(*flight)
+                    except (TypeError, ValueError):
+                        skipped.append(flight[0])
+            except BaseException:
+                self._reset()
+                raise
+            self.loaded = True
+            self.version += 1
+            self.rebuild_reachability_async()
+            return skipped
+
+    def ensure_loaded(self, fetch):
+        """Load the graph from `fetch()` unless it is loaded already. The lock
+        is held while fetching, so concurrent updates wait instead of being lost."""
+        with self._lock:
+            if not self.loaded:
+                return self.load(*fetch())
+            return []
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self.loaded = True
+            self.reach = [[] for _ in range(MAX_STOPS + 1)]
+            self.version += 1
+
+    def invalidate(self):
+        """Drop the graph, the next ensure_loaded() reloads it."""
+        with self._lock:
+            self._reset()
+            self.loaded = False
+            self.version += 1
+
+    def _add_city(self, name):
+        self.cities.add(name)
+        self.city_airports.setdefault(name, [])
+
+    def _add_airport(self, code, city):
+        if code in self.airport_index:
+            return self.airport_index[code]
+        index = len(self.airport_codes)
+        if self.reach is not None:
+            for row in self.reach:
+                row.append(0)
+        self.airport_codes.append(code)
+        self.airport_index[code] = index
+        self.adjacency.append(array('i'))
+        if city is not None:
+            self._add_city(city)
+            self.city_airports[city].append(index)
+        return index
+
+    def _add_flight(self, number, from_code, to_code, price, minutes, operator):
+        if number in self.flight_index:
+            return
+        # Pirma konvertuojame, kad bloga eilute nepaliktu pusiau papildytu masyvu
+        price = float(price)
+        minutes = float(minutes)
+        from_index = self._add_airport(from_code, None)
+        to_index = self._add_airport(to_code, None)
+        index = len(self.flight_numbers)
+        self.flight_numbers.append(number)
+        self.flight_operators.append(operator)
+        self.flight_from.append(from_index)
+        self.flight_to.append(to_index)
+        self.flight_price.append(price)
+        self.flight_time.append(minutes)
+        self.flight_index[number] = index
+        # Skrydis matomas paieskai tik kai visi masyvai jau papildyti
+        self.adjacency[from_index].append(index)
+        if self.reach is not None:
+            self._extend_reachability(from_index, to_index)
+
+    def _extend_reachability(self, u, v):
+        # Naujas skrydis u -> v: oro uostui x, pasiekianciam u per j skrydziu, su k persedimu
+        # tampa pasiekiama v ir viskas, kas is v pasiekiama per k - j - 1 persedima.
+        # Naudojamos senos v eilutes, todel skaiciuojama pries keiciant reach
+        reach = self.reach
+        gained = [1 << v]
+        for k in range(len(reach) - 1):
+            gained.append((1 << v) | reach[k][v])
+        u_bit = 1 << u
+        for x in range(len(self.airport_codes)):
+            if x == u:
+                legs = 0
+            else:
+                legs = next((k + 1 for k in range(len(reach) - 1) if reach[k][x] & u_bit), None)
+                if legs is None:
+                    continue
+            for k in range(legs, len(reach)):
+                reach[k][x] |= gained[k - legs]
+
+    # Incremental updates are ignored until the engine is loaded, load() will pick them up
+    def add_city(self, name):
+        with self._lock:
+            if self.loaded:
+                self._add_city(name)
+                self.version += 1
+
+    def add_airport(self, code, city):
+        with self._lock:
+            if self.loaded:
+                self._add_airport(code, city)
+                self.version += 1
+
+    def add_flight(self, number, from_code, to_code, price, minutes, operator):
+        with self._lock:
+            if self.loaded:
+                self._add_flight(number, from_code, to_code, price, minutes, operator)
+                self.version += 1
+
+    def add_flights(self, flights):
+        """Add many (number, from, to, price, minutes, operator) flights. The
+        reachability index is dropped instead of being updated for every flight,
+        call rebuild_reachability_async() when the import is done."""
+        with self._lock:
+            if self.loaded:
+                self.reach = None
+                for flight in flights:
+                    self._add_flight(*flight)
+                self.version += 1
+
+    def rebuild_reachability_async(self):
+        """Rebuild the reachability index in a background thread, unless one is already running."""
+        with self._lock:
+            if self._reach_thread is not None and self._reach_thread.is_alive():
+                return
+            self._reach_thread = threading.Thread(target=self._rebuild_reachability, daemon=True)
+            self._reach_thread.start()
+
+    def _rebuild_reachability(self):
+        while True:
+            with self._lock:
+                if not self.loaded or self.reach is not None:
+                    return
+                version = self.version
+                destinations = [{self.flight_to[flight] for flight in flights} for flights in self.adjacency]
+
+            # Skaiciuojama be uzrakto; jei tuo metu grafas pasikeite - kartojame
+            direct = [0] * len(destinations)
+            for airport, targets in enumerate(destinations):
+                for target in targets:
+                    direct[airport] |= 1 << target
+            reach = [direct]
+            for _ in range(MAX_STOPS):
+                previous = reach[-1]
+                row = list(direct)
+                for airport, targets in enumerate(destinations):
+                    for target in targets:
+                        row[airport] |= previous[target]
+                reach.append(row)
+
+            with self._lock:
+                if self.version == version and self.loaded:
+                    self.reach = reach
+                    return
+
+    def reachable(self, from_city, to_city, max_stops=MAX_STOPS):
+        """Return the fewest stops needed to fly between the cities, or None
+        if it takes more than `max_stops`."""
+        targets = 0
+        for airport in self.airports_in_city(to_city):
+            targets |= 1 << airport
+        origins = self.airports_in_city(from_city)
+
+        reach = self.reach
+        if reach is None:
+            # Indeksas dar kuriamas - atsakome paieska i ploti
+            self.rebuild_reachability_async()
+            with self._lock:
+                return self._reachable_bfs(origins, targets, max_stops)
+
+        for stops in range(max_stops + 1):
+            row = reach[stops]
+            if any(row[airport] & targets for airport in origins):
+                return stops
+        return None
+
+    def _reachable_bfs(self, origins, targets, max_stops):
+        seen = 0
+        frontier = set(origins)
+        for stops in range(max_stops + 1):
+            next_frontier = set()
+            for airport in frontier:
+                for flight in self.adjacency[airport]:
+                    target = self.flight_to[flight]
+                    if (targets >> target) & 1:
+                        return stops
+                    if not (seen >> target) & 1:
+                        seen |= 1 << target
+                        next_frontier.add(target)
+            frontier = next_frontier
+        return None
+
+    def has_city(self, name):
+        return name in self.cities
+
+    def airports_in_city(self, name):
+        return self.city_airports.get(name, [])
+
+    def search(self, from_city, to_city, sort="price", limit=DEFAULT_ROUTE_LIMIT, max_stops=MAX_STOPS):
+        """Return up to `limit` cheapest (or shortest) routes with at most
+        `max_stops` stops, as lists of flight indexes.
+
+        Bounded-hop label-setting search over loop-free routes: labels are
+        popped in cost order and each (airport, legs, visited airports) state
+        is settled at most `limit` times. Labels sharing that state can be
+        extended by exactly the same flights, so a later one can't be part of
+        the top-k and the first `limit` routes reaching a destination are it.
+        """
+        weights = self.flight_price if sort == "price" else self.flight_time
+        targets = set(self.airports_in_city(to_city))
+        max_legs = max_stops + 1
+        counter = itertools.count()
+
+        heap = [(0.0, next(counter), airport, ()) for airport in self.airports_in_city(from_city)]
+        heapq.heapify(heap)
+        settled = {}
+        routes = []
+
+        while heap and len(routes) < limit:
+            cost, _, airport, legs = heapq.heappop(heap)
+            if legs and airport in targets:
+                routes.append(legs)
+                continue
+
+            if len(legs) >= max_legs:
+                continue
+
+            # Neleidziame grizti i jau aplankyta oro uosta
+            visited = {self.flight_from[leg] for leg in legs}
+            visited.add(airport)
+
+            state = (airport, len(legs), frozenset(visited))
+            if settled.get(state, 0) >= limit:
+                continue
+            settled[state] = settled.get(state, 0) + 1
+            for flight in self.adjacency[airport]:
+                next_airport = self.flight_to[flight]
+                if next_airport in visited:
+                    continue
+                heapq.heappush(heap, (cost + weights[flight], next(counter), next_airport, legs + (flight,)))
+
+        return routes
+
+    def describe(self, legs):
+        flights = []
+        for leg in legs:
+            flights.append({
+                "number": self.flight_numbers[leg],
+                "fromAirport": self.airport_codes[self.flight_from[leg]],
+                "toAirport": self.airport_codes[self.flight_to[leg]],
+                "price": _number(self.flight_price[leg]),
+                "flightTimeInMinutes": _number(self.flight_time[leg]),
+                "operator": self.flight_operators[leg]
+            })
+        return {
+            "fromAirport": flights[0]["fromAirport"],
+            "toAirport": flights[-1]["toAirport"],
+            "flights": flights,
+            "price": _number(sum(self.flight_price[leg] for leg in legs)),
+            "flightTimeInMinutes": _number(sum(self.flight_time[leg] for leg in legs)),
+            "stop_count": len(legs) - 1
+        }
+
+
+# Grazinama is RouteCache, kai rezultato cache nera
+MISSING = object()
+
+
+class RouteCache:
+    """Route search results keyed by (fromCity, toCity, sort, maxStops).
+
+    Every entry is also keyed by the graph version, and writes that change the
+    graph call bump(), so results computed before a change are never served.
+    With a Redis client the entries and the version are shared between
+    processes. Otherwise the entries live in a bounded in-process LRU, and the
+    version is read with `read_version()` and increased with `bump_version()`
+    (kept in Neo4j by the app) at most every `version_ttl` seconds, so other
+    processes' changes are seen within that time. Concurrent misses for the
+    same key wait for a single computation.
+    """
+
+    VERSION_KEY = "routes:version"
+
+    def __init__(self, max_size=10000, redis_client=None, ttl=3600, wait_timeout=10,
+                 read_version=None, bump_version=None, version_ttl=1):
+        self.max_size = max_size
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.read_version = read_version
+        self.bump_version = bump_version
+        self.version_ttl = version_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._version = 0
+        self._version_read_at = None
+
+    def _set_version(self, version):
+        # Seni irasai nebepasiekiami, todel atlaisviname vieta
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+            self._version = version
+            self._version_read_at = time.monotonic()
+        return version
+
+    def version(self):
+        if self.redis_client is not None:
+            return int(self.redis_client.get(self.VERSION_KEY) or 0)
+        if self.read_version is not None:
+            with self._lock:
+                fresh = self._version_read_at is not None \
+                    and time.monotonic() - self._version_read_at < self.version_ttl
+            if not fresh:
+                return self._set_version(self.read_version())
+        return self._version
+
+    def bump(self):
+        """Invalidate every cached result, returns the new graph version."""
+        if self.redis_client is not None:
+            return self.redis_client.incr(self.VERSION_KEY)
+        if self.bump_version is not None:
+            return self._set_version(self.bump_version())
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            return self._version
+
+    def _get(self, cache_key):
+        if self.redis_client is not None:
+            cached = self.redis_client.get("routes:" + json.dumps(cache_key))
+            return json.loads(cached) if cached is not None else MISSING
+        with self._lock:
+            if cache_key not in self._entries:
+                return MISSING
+            self._entries.move_to_end(cache_key)
+            return self._entries[cache_key]
+
+    def _set(self, cache_key, value):
+        if self.redis_client is not None:
+            self.redis_client.set("routes:" + json.dumps(cache_key), json.dumps(value), ex=self.ttl)
+            return
+        with self._lock:
+            self._entries[cache_key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        cache_key = (self.version(), *key)
+        value = self._get(cache_key)
+        if value is not MISSING:
+            return value
+
+        with self._lock:
+            event = self._inflight.get(cache_key)
+            leader = event is None
+            if leader:
+                event = self._inflight[cache_key] = threading.Event()
+
+        if not leader:
+            event.wait(self.wait_timeout)
+            value = self._get(cache_key)
+            return value if value is not MISSING else compute()
+
+        try:
+            value = compute()
+            self._set(cache_key, value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(cache_key, None)
+            event.set()
+
+
+def fetch_route_graph(tx):
+    batch = QueryBatch()
+    batch.add("""
+        MATCH (c:City)
+        RETURN c.name AS name
+        """)
+    batch.add("""
+        MATCH (c:City)-[:HAS_AIRPORT]->(a:Airport)
+        RETURN a.code AS code, c.name AS city
+        """)
+    batch.add("""
+        MATCH (from:Airport)-[f:FLIES_TO]->(to:Airport)
+        RETURN f.number AS number, from.code AS from_code, to.code AS to_code, f.price AS price,
+               f.flightTimeInMinutes AS flightTimeInMinutes, f.operator AS operator
+        """)
+    cities, airports, flights = batch.run(tx)
+    return ([record["name"] for record in cities],
+            [(record["code"], record["city"]) for record in airports],
+            [(record["number"], record["from_code"], record["to_code"], record["price"],
+              record["flightTimeInMinutes"], record["operator"]) for record in flights])
 
 def create_app():
     app = Flask(__name__)
 
+    # Prisijungimo nustatymai, numatytosios reiksmes imamos is aplinkos kintamuju
+    app.config.setdefault("NEO4J_URI", os.environ.get("NEO4J_URI", "bolt://localhost:7687"))
+    app.config.setdefault("NEO4J_USER", os.environ.get("NEO4J_USER", "neo4j"))
+    app.config.setdefault("NEO4J_PASSWORD", os.environ.get("NEO4J_PASSWORD", "newpassword"))
+    app.config.setdefault("NEO4J_MAX_CONNECTIONS", int(os.environ.get("NEO4J_MAX_CONNECTIONS", 100)))
+    app.config.setdefault("NEO4J_MAX_CONNECTION_AGE", float(os.environ.get("NEO4J_MAX_CONNECTION_AGE", 3600)))
+    app.config.setdefault("NEO4J_ACQUISITION_TIMEOUT", float(os.environ.get("NEO4J_ACQUISITION_TIMEOUT", 60)))
+    app.config.setdefault("NEO4J_MAX_RETRY_TIME", float(os.environ.get("NEO4J_MAX_RETRY_TIME", 15)))
+
+    db = Database(
+        app.config["NEO4J_URI"],
+        (app.config["NEO4J_USER"], app.config["NEO4J_PASSWORD"]),
+        max_connections=app.config["NEO4J_MAX_CONNECTIONS"],
+        max_connection_age=app.config["NEO4J_MAX_CONNECTION_AGE"],
+        acquisition_timeout=app.config["NEO4J_ACQUISITION_TIMEOUT"],
+        max_retry_time=app.config["NEO4J_MAX_RETRY_TIME"]
+    )
+    # Schema sukuriama pirmo prisijungimo metu, ne importuojant moduli
+    db.on_connect(lambda graph: bootstrap_schema(graph, app.logger))
+
+    @app.errorhandler(ConnectionUnavailable)
+    @app.errorhandler(ConnectionBroken)
+    @app.errorhandler(ConnectionLimit)
+    @app.errorhandler(ServiceUnavailable)
+    def database_unavailable(e):
+        return jsonify({"message": "Database unavailable", "error": str(e)}), 503
+
+    app.config.setdefault("FLIGHT_IMPORT_BATCH_SIZE", DEFAULT_FLIGHT_IMPORT_BATCH_SIZE)
+
+    # Marsrutu paieskos cache, pasirinktinai bendras visiems procesams per Redis
+    app.config.setdefault("ROUTE_CACHE_SIZE", 10000)
+    app.config.setdefault("ROUTE_CACHE_TTL", 3600)
+    app.config.setdefault("ROUTE_CACHE_REDIS_URL", os.environ.get("ROUTE_CACHE_REDIS_URL"))
+
+    cache_redis_client = None
+    if app.config["ROUTE_CACHE_REDIS_URL"]:
+        import redis
+        cache_redis_client = redis.Redis.from_url(app.config["ROUTE_CACHE_REDIS_URL"])
+
+    # Be Redis grafo versija laikoma Neo4j ir tikrinama ne dazniau nei kas tiek sekundziu
+    app.config.setdefault("ROUTE_VERSION_CHECK_INTERVAL", 1)
+
+    route_cache = RouteCache(
+        max_size=app.config["ROUTE_CACHE_SIZE"],
+        redis_client=cache_redis_client,
+        ttl=app.config["ROUTE_CACHE_TTL"],
+        read_version=lambda: db.read(lambda tx: tx.run(GRAPH_VERSION_READ_QUERY).evaluate()),
+        bump_version=lambda: db.write(lambda tx: tx.run(GRAPH_VERSION_BUMP_QUERY).evaluate()),
+        version_ttl=app.config["ROUTE_VERSION_CHECK_INTERVAL"]
+    )
+
+    # Marsrutu paieskos variklis - sio proceso atmintyje laikomas grafas
+    route_engine = RouteEngine()
+
+    # Grafo versija, kuria atitinka sio proceso paieskos variklis
+    engine_graph_version = [None]
+
+    # Call after every write that changes cities, airports or flights
+    def graph_changed():
+        version = route_cache.bump()
+        # Variklis jau atnaujintas sio proceso; jei tarpe buvo kitu procesu pakeitimu - perkrausime
+        if engine_graph_version[0] == version - 1:
+            engine_graph_version[0] = version
+
+    # Make sure the route engine reflects the current graph version
+    def sync_route_engine():
+        version = route_cache.version()
+        if engine_graph_version[0] != version:
+            route_engine.invalidate()
+            engine_graph_version[0] = version
+        skipped = route_engine.ensure_loaded(lambda: db.read(fetch_route_graph))
+        if skipped:
+            app.logger.warning("Skipped %d flights with invalid price or flight time: %s",
+                               len(skipped), ", ".join(map(str, skipped[:20])))
+
+    # Write flight rows (each with a "line" key) in one transaction.
+    # Returns {line: created}, rows whose airports don't exist are missing.
+    # Bulk writes drop the reachability index, it is rebuilt after the import
+    def write_flights(rows, bulk=False):
+        result = db.write_data(FLIGHT_WRITE_QUERY, rows=rows)
+        created = {record["line"]: record["created"] for record in result}
+
+        flights = [(row["number"], row["fromAirport"], row["toAirport"],
+                    row["price"], row["flightTimeInMinutes"], row["operator"])
+                   for row in rows if created.get(row["line"])]
+        if bulk:
+            route_engine.add_flights(flights)
+        else:
+            for flight in flights:
+                route_engine.add_flight(*flight)
+        if flights:
+            graph_changed()
+        return created
+
+    # Validate parsed rows and write them in batches, yielding a report for every rejected row
+    # and a summary at the end
+    def import_flights(parsed_rows, batch_size):
+        imported = 0
+        failed = 0
+        batch = []
+        batch_numbers = set()
+
+        def flush():
+            nonlocal imported, failed
+            created = write_flights(batch, bulk=True)
+            for row in batch:
+                if row["line"] not in created:
+                    failed += 1
+                    yield {"line": row["line"], "message": "One or both airports not found"}
+                elif not created[row["line"]]:
+                    failed += 1
+                    yield {"line": row["line"], "message": "Flight with this number already exists"}
+                else:
+                    imported += 1
+            batch.clear()
+            batch_numbers.clear()
+
+        for line_no, row, error in parsed_rows:
+            if error is None:
+                error = validate_flight(row)
+            # Tame paciame pakete MERGE nematytu ankstesnes eilutes su tuo paciu numeriu
+            if error is None and row["number"] in batch_numbers:
+                error = "Duplicate flight number in import"
+            if error:
+                failed += 1
+                yield {"line": line_no, "message": error}
+                continue
+
+            batch.append({"line": line_no, **{field: row[field] for field in FLIGHT_FIELDS}})
+            batch_numbers.add(row["number"])
+            if len(batch) >= batch_size:
+                yield from flush()
+
+        if batch:
+            yield from flush()
+
+        if imported:
+            route_engine.rebuild_reachability_async()
+        yield {"imported": imported, "failed": failed}
+
+    @app.cli.command("import-flights")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--batch-size", default=DEFAULT_FLIGHT_IMPORT_BATCH_SIZE, show_default=True)
+    @click.option("--format", "fmt", type=click.Choice(["ndjson", "csv"]), default=None,
+                  help="Defaults to csv for .csv files, ndjson otherwise.")
+    def import_flights_command(path, batch_size, fmt):
+        """Import a flight schedule file."""
+        if fmt is None:
+            fmt = "csv" if path.lower().endswith(".csv") else "ndjson"
+        with open(path, newline="", encoding="utf-8") as lines:
+            for report in import_flights(parse_flight_rows(lines, fmt), batch_size):
+                click.echo(json.dumps(report))
+
+    @app.cli.command("migrate-flies-to")
+    @click.option("--batch-size", default=DEFAULT_FLIGHT_IMPORT_BATCH_SIZE, show_default=True)
+    def migrate_flies_to_command(batch_size):
+        """Create FLIES_TO relationships for existing flights."""
+        def migrate_batch(tx, after):
+            # Skrydziai einami pagal numeri (indeksuotas unikalumo apribojimu), MERGE leidzia kartoti migracija
+            numbers = [record["number"] for record in tx.run("""
+                MATCH (f:Flight)
+                WHERE $after IS NULL OR f.number > $after
+                RETURN f.number AS number
+                ORDER BY f.number
+                LIMIT $batch_size
+                """, after=after, batch_size=batch_size)]
+            if numbers:
+                tx.run(FLIES_TO_BACKFILL_QUERY, numbers=numbers)
+            return numbers
+
+        after = None
+        migrated = 0
+        while True:
+            numbers = db.write(lambda tx: migrate_batch(tx, after))
+            if not numbers:
+                break
+            migrated += len(numbers)
+            after = numbers[-1]
+            click.echo(f"Migrated {migrated} flights")
+
+    # Keyset pagination arguments. Without limit the whole list is streamed
+    def page_args():
+        limit = request.args.get("limit", type=int)
+        if limit is not None:
+            limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        return limit, request.args.get("after", ""), request.args.get("afterKey", "")
+
+    # One page as JSON. A full page gets a Link header pointing to the next one,
+    # which starts after the last item's (name, key_field)
+    def page_response(items, limit, key_field):
+        response = jsonify(items)
+        if len(items) == limit:
+            args = request.args.to_dict()
+            args.update(after=items[-1]["name"], afterKey=items[-1][key_field])
+            next_url = url_for(request.endpoint, **request.view_args, **args)
+            response.headers["Link"] = f'<{next_url}>; rel="next"'
+        return response, 200
+
+    # JSON array written while the records generator is consumed. The first record is
+    # read before the response starts, so database errors still end in a 503.
+    # Returns None if there are no records
+    def stream_response(records):
+        first = next(records, MISSING)
+        if first is MISSING:
+            return None
+
+        def generate():
+            try:
+                yield "[" + json.dumps(first)
+                for record in records:
+                    yield "," + json.dumps(record)
+                yield "]"
+            finally:
+                records.close()
+
+        return Response(generate(), mimetype="application/json")
+
+    # HEALTH CHECK
+    @app.route('/health', methods=['GET'])
+    def health():
+        try:
+            db.read(lambda tx: tx.run("RETURN 1").evaluate(), max_retry_time=0)
+        except Exception as e:
+            return jsonify({"status": "unhealthy", "error": str(e)}), 503
+        return jsonify({"status": "ok"}), 200
+
     # REGISTER A NEW CITY
     @app.route('/cities', methods=['PUT'])
     def register_city():
@@ -17,47 +999,50 @@ def create_app():
         if not name or not country:
             return jsonify({"message": "Could not register the city. Mandatory attributes are missing"}), 400
         
-        # PAtikriname, ar miestas jau egzistuoja
-        query_check = """
-        MATCH (c:City {name: $name, country: $country})
-        RETURN c
+        # MERGE sukuria miesta tik jei jo dar nera, statistika parodo, ar mazgas sukurtas
+        query = """
+        MERGE (c:City {name: $name, country: $country})
+        RETURN c.name AS name
         """
-        exists = graph.run(query_check, name=name, country=country).data()
+        created = db.write(lambda tx: tx.run(query, name=name, country=country).stats().get("nodes_created", 0))
 
-        if exists:
+        if not created:
             return jsonify({"message": "Could not register the city, it already ezists"}), 400
 
-        query_create = """
-        CREATE (c:City {name: $name, country: $country})
-        RETURN c
-        """
-        graph.run(query_create, name=name, country=country)
+        route_engine.add_city(name)
+        graph_changed()
 
         return jsonify({"message": "City registered succesfully"}), 204
 
 
     # GET CITIES
-    # Get all cities in the system. Can be filtered by country
+    # Get all cities in the system. Can be filtered by country.
+    # With limit - pages ordered by name (after/afterKey = last name/country), otherwise streamed
     @app.route('/cities', methods=['GET'])
     def get_cities():
         country = request.args.get("country")
+        limit, after, after_key = page_args()
 
         # Jei nurodyta konkreti salis, rodome tos salies miestus
-        if country:
-            query = """
-            MATCH (c:City {country: $country})
-            RETURN c.name AS name, c.country AS country
-            """
-            cities = graph.run(query, country=country).data()
+        match = "MATCH (c:City {country: $country})" if country else "MATCH (c:City)"
 
-        else:
-            query = """
-            MATCH (c:City)
+        if limit is None:
+            query = match + """
             RETURN c.name AS name, c.country AS country
             """
-            cities = graph.run(query).data()
+            response = stream_response(db.stream(query, country=country))
+            return response if response is not None else (jsonify([]), 200)
 
-        return jsonify(cities), 200
+        # Puslapis pradedamas nuo city_name indekso intervalo po paskutinio matyto miesto
+        query = match + """
+        WHERE c.name >= $after AND (c.name > $after OR c.country > $after_key)
+        RETURN c.name AS name, c.country AS country
+        ORDER BY name, country
+        LIMIT $limit
+        """
+        cities = db.read_data(query, country=country, after=after, after_key=after_key, limit=limit)
+
+        return page_response(cities, limit, "country")
 
 
     # GET CITY
@@ -68,7 +1053,7 @@ def create_app():
         MATCH (c:City {name: $name})
         RETURN c.name AS name, c.country AS country"""
 
-        result = graph.run(query_check, name=name).data()
+        result = db.read_data(query_check, name=name)
 
         # Jei nera rezultato, graziname klaidos pranesima
         if not result:
@@ -91,35 +1076,29 @@ def create_app():
         if not code or not airport_name or not number_of_terminals or not address:
             return jsonify({"message": "Airport could not be created due to missing data"}), 400
 
-        # Patrikriname, ar nurodytas miestas egzistuoja
-        city_query = """
+        # Viena uzklausa: jei miesto nera - eiluciu nebus, jei oro uostas jau yra - created = false.
+        # Rysys su miestu kuriamas tik naujam oro uostui
+        create_airport_query = """
         MATCH (c:City {name: $name})
-        RETURN c
+        WITH c LIMIT 1
+        MERGE (a:Airport {code: $code})
+        ON CREATE SET a.name = $airport_name, a.numberOfTerminals = $number_of_terminals, a.address = $address,
+                      a._created = true
+        WITH c, a, a._created IS NOT NULL AS created
+        REMOVE a._created
+        FOREACH (_ IN CASE WHEN created THEN [1] ELSE [] END | CREATE (c)-[:HAS_AIRPORT]->(a))
+        RETURN created
         """
-        city = graph.run(city_query, name=name).data()
+        result = db.write_data(create_airport_query, name=name, code=code, airport_name=airport_name, number_of_terminals=number_of_terminals, address=address)
 
-        if not city:
+        if not result:
             return jsonify({"message": "City not found"}), 404
 
-        # Patikriname, ar oro uostas su tokiu kodu jau egzistuoja
-        airport_query = """
-        MATCH (a:Airport {code: $code})
-        RETURN a
-        """
-
-        airport_exists = graph.run(airport_query, code=code).data()
-
-        if airport_exists:
+        if not result[0]["created"]:
             return jsonify({"message": "Could not register the airport, it already exists"}), 400
 
-        # Sukuriame nauja oro uosta ir susiejame ji su miestu
-        create_airport_query = """
-        MATCH (c:City {name: $name})
-        CREATE (a:Airport {code: $code, name: $airport_name, numberOfTerminals: $number_of_terminals, address: $address})
-        CREATE (c)-[:HAS_AIRPORT]->(a)
-        RETURN a
-        """
-        graph.run(create_airport_query, name=name, code=code, airport_name=airport_name, number_of_terminals=number_of_terminals, address=address)
+        route_engine.add_airport(code, name)
+        graph_changed()
 
         return jsonify({"message": "Airport created"}), 204
 
@@ -129,25 +1108,66 @@ def create_app():
         # Patikriname, ar nurodytas miestas egzistuoja
         city_query = """
         MATCH (c:City {name: $name})
-        RETURN c
+        RETURN c.name AS name
+        LIMIT 1
         """
 
-        city = graph.run(city_query, name=name).data()
+        limit, after, after_key = page_args()
 
-        if not city:
-            return jsonify({"message": "City not found"}), 404
+        # Gauti visus oro uostus, susijusius su miestu.
+        # Miestas be oro uostu grazina viena eilute su null, nezinomas miestas - nei vienos
+        if limit is None:
+            airports_query = """
+            MATCH (c:City {name: $name})
+            OPTIONAL MATCH (c)-[:HAS_AIRPORT]->(a:Airport)
+            RETURN a.code AS code, a.name AS name, a.numberOfTerminals AS numberOfTerminals, a.address AS address
+            """
+            records = db.stream(airports_query, name=name)
+            city_found = False
+            first = None
+            for record in records:
+                city_found = True
+                if record["code"] is not None:
+                    first = record
+                    break
+            if first is None:
+                if not city_found:
+                    return jsonify({"message": "City not found"}), 404
+                return jsonify({"message": "No airports found in the city"}), 404
+
+            def airports():
+                try:
+                    yield first
+                    for record in records:
+                        if record["code"] is not None:
+                            yield record
+                finally:
+                    records.close()
 
-        # Gauti visus oro uostus, susijusius su miestu
+            return stream_response(airports())
+
+        # Puslapiai rikiuojami pagal pavadinima, o vienodi pavadinimai - pagal koda
         airports_query = """
         MATCH (c:City {name: $name})-[:HAS_AIRPORT]->(a:Airport)
+        WHERE a.name >= $after AND (a.name > $after OR a.code > $after_key)
         RETURN a.code AS code, a.name AS name, a.numberOfTerminals AS numberOfTerminals, a.address AS address
+        ORDER BY name, code
+        LIMIT $limit
         """
-        airpots = graph.run(airports_query, name=name).data()
+        # Miesto patikrinimas ir puslapis - viena uzklausa
+        batch = QueryBatch()
+        batch.add(city_query, name=name)
+        batch.add(airports_query, name=name, after=after, after_key=after_key, limit=limit)
+        city, airpots = db.read(batch.run)
+
+        if not city:
+            return jsonify({"message": "City not found"}), 404
 
-        if not airpots:
+        # Tuscias ne pirmas puslapis reiskia tik saraso pabaiga
+        if not airpots and not after:
             return jsonify({"message": "No airports found in the city"}), 404
 
-        return jsonify(airpots), 200
+        return page_response(airpots, limit, "code")
 
 
     # GET AIRPORT
@@ -158,7 +1178,7 @@ def create_app():
         MATCH (a:Airport {code: $code})<-[:HAS_AIRPORT]-(c:City)
         RETURN a.code AS code, a.name AS name, a.numberOfTerminals AS numberOfTerminals, a.address AS address, c.name AS city_name
         """
-        result = graph.run(query, code=code).data()
+        result = db.read_data(query, code=code)
 
         if not result:
             return jsonify({"message": "Airport not found"}), 404
@@ -179,54 +1199,52 @@ def create_app():
     @app.route('/flights', methods=['PUT'])
     def register_new_flight():
         req = request.get_json()
-        number = req.get("number")
-        fromAirport = req.get("fromAirport")
-        toAirport = req.get("toAirport")
-        price = req.get("price")
-        flightTimeInMinutes = req.get("flightTimeInMinutes")
-        operator = req.get("operator")
-
-        if not number or not fromAirport or not toAirport or not price or not flightTimeInMinutes or not operator:
-            return jsonify({"message": "Flight could not be created due to missing data"}), 400
-
-        # Patikriname, ar abu oro uostai egzistuoja
-        from_airport_query = """
-        MATCH (a:Airport {code: $fromAirport})
-        RETURN a
-        """
-        from_airport_exists = graph.run(from_airport_query, fromAirport=fromAirport).data()
+        flight = {field: req.get(field) for field in FLIGHT_FIELDS}
 
-        to_airport_query = """
-        MATCH (a:Airport {code: $toAirport})
-        RETURN a
-        """
-        to_airport_exists = graph.run(to_airport_query, toAirport=toAirport).data()
+        # Tie patys patikrinimai kaip importuojant tvarkarasti
+        error = validate_flight(flight)
+        if error:
+            return jsonify({"message": error}), 400
 
-        if not from_airport_exists or not to_airport_exists:
+        # Sukuriame skrydi ir siejame ji su abiem oro uostais viena uzklausa
+        result = write_flights([{"line": 1, **flight}])
+
+        if 1 not in result:
             return jsonify({"message": "One or both airports not found"}), 404
 
-        # Sukuriame skrydi ir siejame ji su abiem oro uostais
-        fligth_query = """
-        MATCH (from:Airport {code: $fromAirport}), (to:Airport {code: $toAirport})
-        CREATE (f:Flight {number: $number, price: $price, flightTimeInMinutes: $flightTimeInMinutes, operator: $operator})
-        CREATE (from)-[:HAS_FLIGHT]->(f)-[:GOES_TO]->(to)
-        RETURN f
-        """
-        graph.run(fligth_query, fromAirport=fromAirport, toAirport=toAirport, number=number, price=price, flightTimeInMinutes=flightTimeInMinutes, operator=operator)
+        if not result[1]:
+            return jsonify({"message": "Flight with this number already exists"}), 400
 
         return jsonify({"message": "Flight created"}), 204
 
+    # IMPORT FLIGHT SCHEDULE
+    # NDJSON (default) or CSV body, written in UNWIND batches. Rejected rows are streamed back
+    @app.route('/flights:import', methods=['POST'])
+    def import_flight_schedule():
+        fmt = request.args.get("format") or ("csv" if request.mimetype == "text/csv" else "ndjson")
+        if fmt not in ("ndjson", "csv"):
+            return jsonify({"message": "format must be 'ndjson' or 'csv'"}), 400
+
+        batch_size = request.args.get("batchSize", app.config["FLIGHT_IMPORT_BATCH_SIZE"], type=int)
+        lines = (line.decode("utf-8") for line in request.stream)
+
+        def generate():
+            for report in import_flights(parse_flight_rows(lines, fmt), batch_size):
+                yield json.dumps(report) + "\n"
+
+        return Response(stream_with_context(generate()), status=200, mimetype="application/x-ndjson")
+
     # GET FULL FLIGHT INFORMATION
     @app.route('/flights/<number>', methods=['GET'])
     def get_full_flight_info(number):
         # Patikriname, ar skrydis egzistuoja
         query = """
-        MATCH (f:Flight {number: $number})<-[:HAS_FLIGHT]-(from:Airport)<-[:HAS_AIRPORT]-(from_city:City),
-              (f)-[:GOES_TO]->(to:Airport)<-[:HAS_AIRPORT]-(to_city:City)
+        MATCH (from:Airport)-[f:FLIES_TO {number: $number}]->(to:Airport)
+        MATCH (from)<-[:HAS_AIRPORT]-(from_city:City), (to)<-[:HAS_AIRPORT]-(to_city:City)
         RETURN f.number AS number, f.price AS price, f.flightTimeInMinutes AS flightTimeInMinutes, f.operator AS operator,
                from.code AS from_airport_code, from_city.name AS from_city_name, to.code AS to_airport_code, to_city.name AS to_city_name
         """
-        result = graph.run(query, number=number).data()
+        result = db.read_data(query, number=number)
 
         if not result:
             return jsonify({"message": "Flight not found"}), 404
@@ -245,68 +1263,73 @@ def create_app():
         }), 200
     
     # FIND FLIGHTS TO AND FROM CITY
-    # Find flights between two cities. Will not search for flights with more than 3 stops
+    # Find flights between two cities. Will not search for flights with more than 3 stops.
+    # Routes are searched in memory (RouteEngine), sorted by price or by flight time
     @app.route('/search/flights/<fromCity>/<toCity>', methods=['GET'])
     def find_flights(fromCity, toCity):
-        # Patikriname, ar abu miestai egzistuoja
-        city_query = """
-        MATCH (from_city:City {name: $fromCity}), (to_city:City {name: $toCity})
-        RETURN from_city, to_city
-        """
-        cities = graph.run(city_query, fromCity=fromCity, toCity=toCity).data()
+        sort = request.args.get("sort", "price")
+        if sort not in ("price", "time"):
+            return jsonify({"message": "sort must be 'price' or 'time'"}), 400
 
-        if not cities:
-            return jsonify({"message": "One or both cities not found"}), 404
-        
-        # Rasti oro uostus susijusius su miestais
-        airports_query = """
-        MATCH (from_city:City {name: $fromCity})-[:HAS_AIRPORT]->(from:Airport),
-              (to_city:City {name: $toCity})-[:HAS_AIRPORT]->(to:Airport)
-        RETURN from.code AS from_airport_code, to.code AS to_airport_code
-        """
-        airports = graph.run(airports_query, fromCity=fromCity, toCity=toCity).data()
+        limit = min(max(request.args.get("limit", DEFAULT_ROUTE_LIMIT, type=int), 1), MAX_ROUTE_LIMIT)
+        max_stops = min(max(request.args.get("maxStops", MAX_STOPS, type=int), 0), MAX_STOPS)
 
-        if not airports:
-            return jsonify({"message": "No airports found in one or both cities"}), 404
-        
-        all_flights = []
-        
-        # Ieskome skrydziu tarp siu oro uostu su ne daugiau kaip 3 sustojimais
-       # for airport in airports:
-        flight_query = """
-        MATCH (from_city:City {name: $fromCity})-[:HAS_AIRPORT]->(from:Airport),
-            (to_city:City {name: $toCity})-[:HAS_AIRPORT]->(to:Airport)
-        MATCH path = (from)-[:HAS_FLIGHT*1..3]->(to)
-        WITH path, nodes(path) AS airports_in_path
-        WHERE SIZE(airports_in_path) - 2 <= 3
-        UNWIND nodes(path) AS airport_node
-        MATCH (f:Flight)-[:GOES_TO]->(to)
-        WHERE airport_node = "from" OR airport_node = "to"
-        RETURN f.number AS flight_number, SUM(f.price) AS price, SUM(f.flightTimeInMinutes) AS flightTimeInMinutes,
-            SIZE(airports_in_path) - 2 AS stop_count
-        """
-            #from_airport_code = airport['from_airport_code']
-            #to_airport_code = airport['to_airport_code']
+        # Rezultatas skaiciuojamas MAX_ROUTE_LIMIT marsrutu ir kesuojamas, limit pritaikomas atskirai
+        def search():
+            # Grafas is duomenu bazes nuskaitomas pirmos paieskos metu arba pasikeitus jo versijai
+            sync_route_engine()
 
-        flights = graph.run(flight_query, fromCity=fromCity, toCity=toCity). data()
+            # Patikriname, ar abu miestai egzistuoja
+            if not route_engine.has_city(fromCity) or not route_engine.has_city(toCity):
+                return {"status": 404, "body": {"message": "One or both cities not found"}}
 
-        all_flights.extend(flights)
-        
-        if not all_flights:
-            return jsonify({"message": "Flights not faund"}), 404
-        
-        return jsonify(all_flights), 200
+            if not route_engine.airports_in_city(fromCity) or not route_engine.airports_in_city(toCity):
+                return {"status": 404, "body": {"message": "No airports found in one or both cities"}}
+
+            routes = route_engine.search(fromCity, toCity, sort=sort, limit=MAX_ROUTE_LIMIT, max_stops=max_stops)
+
+            if not routes:
+                return {"status": 404, "body": {"message": "Flights not faund"}}
+
+            return {"status": 200, "body": [route_engine.describe(route) for route in routes]}
+
+        result = route_cache.get_or_compute((fromCity, toCity, sort, max_stops), search)
+
+        if result["status"] != 200:
+            return jsonify(result["body"]), result["status"]
+
+        return jsonify(result["body"][:limit]), 200
+
+
+    # REACHABILITY
+    # Whether toCity can be reached from fromCity with at most maxStops stops (default 3),
+    # answered from the in-memory reachability index
+    @app.route('/reachability/<fromCity>/<toCity>', methods=['GET'])
+    def get_reachability(fromCity, toCity):
+        max_stops = min(max(request.args.get("maxStops", MAX_STOPS, type=int), 0), MAX_STOPS)
+
+        sync_route_engine()
+
+        if not route_engine.has_city(fromCity) or not route_engine.has_city(toCity):
+            return jsonify({"message": "One or both cities not found"}), 404
+
+        stops = route_engine.reachable(fromCity, toCity, max_stops=max_stops)
+
+        return jsonify({"reachable": stops is not None, "stops": stops}), 200
 
 
     # CLEANUP
     @app.route('/cleanup', methods=['POST'])
     def cleanup():
         try:
-            # Triname visus mazgus ir rysius
+            # Triname visus mazgus ir rysius, isskyrus grafo versija - ja veliau padidiname,
+            # kad kiti procesai pamatytu pakeitima
             query = """
-            MATCH (n) DETACH DELETE n
+            MATCH (n) WHERE NOT n:GraphVersion DETACH DELETE n
             """
-            graph.run(query)
+            db.write(lambda tx: tx.run(query))
+            route_engine.clear()
+            graph_changed()
 
             return jsonify ({"message": "Cleanup successful"}), 200
         except Exception as e:
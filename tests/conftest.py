@@ -0,0 +1,95 @@
+import importlib.util
+import os
+import re
+
+import pytest
+
+MODULE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "neo4j.py")
+
+
+class FakeCursor:
+    def __init__(self, records):
+        self.records = records
+
+    def data(self):
+        return [dict(record) for record in self.records]
+
+    def evaluate(self):
+        return next(iter(self.records[0].values())) if self.records else None
+
+    def __iter__(self):
+        return iter(self.records)
+
+
+class FakeTx:
+    """Records every (statement, parameters). A batched statement returns one
+    row holding the rows given in `results` for each subquery, like Neo4j does
+    when every subquery aggregates on its own. The graph version statements
+    read and increase FakeGraph.version, other statements return `rows`."""
+
+    def __init__(self, calls, results, rows=()):
+        self.calls = calls
+        self.results = results
+        self.rows = rows
+
+    def run(self, query, **parameters):
+        self.calls.append((query, parameters))
+        if "GraphVersion" in query:
+            if "SET" in query:
+                FakeGraph.version += 1
+            return FakeCursor([{"value": FakeGraph.version}])
+        batches = re.findall(r"AS (_batch\d+)", query)
+        if not batches:
+            return FakeCursor(list(self.rows))
+        return FakeCursor([{batch: self.results.get(batch, []) for batch in batches}])
+
+
+class FakeGraph:
+    calls = []
+    results = {}
+    rows = []
+    version = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def run(self, query, **parameters):
+        return FakeCursor([])
+
+    def begin(self, readonly=False):
+        return FakeTx(FakeGraph.calls, FakeGraph.results, FakeGraph.rows)
+
+    def commit(self, tx):
+        pass
+
+    def rollback(self, tx):
+        pass
+
+
+@pytest.fixture(scope="session")
+def neo4j_module():
+    # neo4j.py uzdengtu neo4j paketo pavadinima, todel kraunamas pagal kelia
+    spec = importlib.util.spec_from_file_location("neo4j_app", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.Graph = FakeGraph
+    return module
+
+
+@pytest.fixture
+def module(neo4j_module):
+    FakeGraph.calls = []
+    FakeGraph.results = {}
+    FakeGraph.rows = []
+    FakeGraph.version = 0
+    return neo4j_module
+
+
+def data_calls():
+    """Recorded statements other than the graph version checks."""
+    return [call for call in FakeGraph.calls if "GraphVersion" not in call[0]]
+
+
+@pytest.fixture
+def client(module):
+    return module.create_app().test_client()
@@ -0,0 +1,31 @@
+import json
+
+from conftest import FakeGraph, data_calls
+
+
+def test_ndjson_rows_with_invalid_values_are_rejected(client):
+    rows = [
+        {"number": "A1", "fromAirport": "VNO", "toAirport": "RIX", "price": "abc", "flightTimeInMinutes": 60, "operator": "o"},
+        {"number": "A2", "fromAirport": "VNO", "toAirport": "RIX", "price": 10, "flightTimeInMinutes": -1, "operator": "o"},
+        {"number": ["A3"], "fromAirport": "VNO", "toAirport": "RIX", "price": 10, "flightTimeInMinutes": 60, "operator": "o"},
+        {"number": {"n": 1}, "fromAirport": "VNO", "toAirport": "RIX", "price": 10, "flightTimeInMinutes": 60, "operator": "o"},
+        {"number": "A5", "fromAirport": 1, "toAirport": "RIX", "price": 10, "flightTimeInMinutes": 60, "operator": "o"},
+    ]
+    body = "\n".join(json.dumps(row) for row in rows)
+
+    response = client.post("/flights:import", data=body, content_type="application/x-ndjson")
+    reports = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert response.status_code == 200
+    assert [report.get("line") for report in reports[:-1]] == [1, 2, 3, 4, 5]
+    assert reports[-1] == {"imported": 0, "failed": 5}
+    assert FakeGraph.calls == []
+
+
+def test_ndjson_numbers_are_written_as_numbers(client):
+    row = {"number": "A1", "fromAirport": "VNO", "toAirport": "RIX", "price": "12.5", "flightTimeInMinutes": 60, "operator": "o"}
+
+    client.post("/flights:import", data=json.dumps(row), content_type="application/x-ndjson")
+
+    assert len(data_calls()) == 1
+    assert data_calls()[0][1]["rows"][0]["price"] == 12.5
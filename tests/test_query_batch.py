@@ -0,0 +1,144 @@
+import pytest
+from py2neo.errors import DatabaseError
+
+from conftest import FakeGraph, FakeTx, data_calls
+
+
+def test_every_subquery_aggregates_on_its_own(module):
+    batch = module.QueryBatch()
+    batch.add("MATCH (c:City {name: $name}) RETURN c.name AS name", name="Vilnius")
+    batch.add("MATCH (a:Airport {code: $name}) RETURN a.name AS name", name="VNO")
+
+    statement = batch.statement()
+
+    # Tarp subuzklausu neturi buti bendro WITH ... collect(), kuris grupuotu eilutes
+    assert "WITH" not in statement
+    assert statement.count("RETURN collect(") == 2
+    assert batch.parameters == {"b0_name": "Vilnius", "b1_name": "VNO"}
+
+
+def test_run_returns_empty_lists_for_empty_queries(module):
+    batch = module.QueryBatch()
+    batch.add("MATCH (c:City) RETURN c.name AS name")
+    batch.add("MATCH (a:Airport) RETURN a.code AS code")
+    calls = []
+
+    assert batch.run(FakeTx(calls, {"_batch0": [{"name": "Vilnius"}]})) == [[{"name": "Vilnius"}], []]
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("url", [
+    "/cities/Unknown/airports?limit=10",
+    "/cities/Unknown/airports?limit=10&after=Z&afterKey=ZZZ",
+])
+def test_paged_airports_of_unknown_city(client, url):
+    response = client.get(url)
+
+    assert response.status_code == 404
+    assert response.get_json() == {"message": "City not found"}
+    assert len(FakeGraph.calls) == 1
+
+
+def test_paged_airports_of_city_without_airports(client):
+    FakeGraph.results = {"_batch0": [{"name": "Vilnius"}]}
+
+    response = client.get("/cities/Vilnius/airports?limit=10")
+
+    assert response.status_code == 404
+    assert response.get_json() == {"message": "No airports found in the city"}
+    assert len(FakeGraph.calls) == 1
+
+
+def test_paged_airports_past_the_end(client):
+    FakeGraph.results = {"_batch0": [{"name": "Vilnius"}]}
+
+    response = client.get("/cities/Vilnius/airports?limit=10&after=Z&afterKey=ZZZ")
+
+    assert response.status_code == 200
+    assert response.get_json() == []
+    assert len(FakeGraph.calls) == 1
+
+
+@pytest.mark.parametrize("url", ["/search/flights/Vilnius/Riga", "/reachability/Vilnius/Riga"])
+def test_route_graph_is_loaded_with_one_statement_when_empty(client, url):
+    response = client.get(url)
+
+    assert response.status_code == 404
+    assert response.get_json() == {"message": "One or both cities not found"}
+    assert len(data_calls()) == 1
+
+
+def test_route_graph_without_flights(client):
+    FakeGraph.results = {
+        "_batch0": [{"name": "Vilnius"}, {"name": "Riga"}],
+        "_batch1": [{"code": "VNO", "city": "Vilnius"}, {"code": "RIX", "city": "Riga"}],
+    }
+
+    response = client.get("/search/flights/Vilnius/Riga")
+
+    assert response.status_code == 404
+    assert response.get_json() == {"message": "Flights not faund"}
+    assert len(data_calls()) == 1
+
+
+def test_streamed_airports_of_unknown_city(client):
+    response = client.get("/cities/Unknown/airports")
+
+    assert response.status_code == 404
+    assert response.get_json() == {"message": "City not found"}
+    assert len(FakeGraph.calls) == 1
+
+
+def test_streamed_airports_of_city_without_airports(client):
+    FakeGraph.rows = [{"code": None, "name": None, "numberOfTerminals": None, "address": None}]
+
+    response = client.get("/cities/Vilnius/airports")
+
+    assert response.status_code == 404
+    assert response.get_json() == {"message": "No airports found in the city"}
+    assert len(FakeGraph.calls) == 1
+
+
+def test_streamed_airports_of_city(client):
+    FakeGraph.rows = [
+        {"code": None, "name": None, "numberOfTerminals": None, "address": None},
+        {"code": "VNO", "name": "Vilnius", "numberOfTerminals": 1, "address": "a"},
+    ]
+
+    response = client.get("/cities/Vilnius/airports")
+
+    assert response.status_code == 200
+    assert response.get_json() == [{"code": "VNO", "name": "Vilnius", "numberOfTerminals": 1, "address": "a"}]
+    assert len(FakeGraph.calls) == 1
+
+
+def test_failed_schema_statement_does_not_fail_requests(module, client, monkeypatch):
+    statements = []
+
+    def run(self, query, **parameters):
+        statements.append(query)
+        if "flight_number" in query:
+            raise DatabaseError("Unable to create constraint",
+                                code="Neo.DatabaseError.Schema.ConstraintCreationFailed")
+
+    monkeypatch.setattr(FakeGraph, "run", run)
+
+    assert client.get("/cities").status_code == 200
+    assert client.get("/cities").status_code == 200
+    # Kiti sakiniai ivykdomi, o schema kuriama tik viena karta
+    assert statements == module.SCHEMA_STATEMENTS
+
+
+def test_schema_connection_error_is_retried_on_next_request(module, client, monkeypatch):
+    attempts = []
+
+    def run(self, query, **parameters):
+        attempts.append(query)
+        if len(attempts) == 1:
+            raise module.ConnectionUnavailable("Neo4j is down")
+
+    monkeypatch.setattr(FakeGraph, "run", run)
+
+    assert client.get("/cities").status_code == 503
+    assert client.get("/cities").status_code == 200
+    assert attempts == module.SCHEMA_STATEMENTS[:1] + module.SCHEMA_STATEMENTS
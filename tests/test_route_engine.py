@@ -0,0 +1,112 @@
+import random
+
+import pytest
+
+from conftest import FakeGraph
+
+
+def test_load_skips_flights_with_invalid_numbers(module):
+    engine = module.RouteEngine()
+
+    skipped = engine.load(
+        ["Vilnius", "Riga"],
+        [("VNO", "Vilnius"), ("RIX", "Riga")],
+        [("BAD", "VNO", "RIX", "abc", 60, "o"), ("OK", "VNO", "RIX", 50, 60, "o")]
+    )
+
+    assert skipped == ["BAD"]
+    assert engine.loaded
+    assert engine.flight_numbers == ["OK"]
+    assert [engine.describe(route)["flights"][0]["number"]
+            for route in engine.search("Vilnius", "Riga")] == ["OK"]
+
+
+def test_failed_load_leaves_engine_unloaded(module):
+    engine = module.RouteEngine()
+
+    with pytest.raises(ValueError):
+        engine.load(["Vilnius"], [("VNO",)], [])
+
+    assert not engine.loaded
+
+
+@pytest.mark.parametrize("fields", [
+    {"price": "abc"}, {"flightTimeInMinutes": -5}, {"flightTimeInMinutes": "nan"}, {"price": [10]}, {"price": True},
+    {"number": ["LY1"]}, {"number": 1}, {"fromAirport": 7}, {"toAirport": {"code": "RIX"}}
+])
+def test_register_flight_rejects_invalid_values(client, fields):
+    response = client.put("/flights", json={
+        "number": "LY1", "fromAirport": "VNO", "toAirport": "RIX",
+        "price": 10, "flightTimeInMinutes": 60, "operator": "o", **fields
+    })
+
+    assert response.status_code == 400
+    assert FakeGraph.calls == []
+
+
+def brute_force_costs(engine, from_city, to_city, sort, limit, max_stops):
+    weights = engine.flight_price if sort == "price" else engine.flight_time
+    targets = set(engine.airports_in_city(to_city))
+    costs = []
+
+    def walk(airport, legs, visited, cost):
+        if legs and airport in targets:
+            costs.append(cost)
+            return
+        if len(legs) > max_stops:
+            return
+        for flight in engine.adjacency[airport]:
+            next_airport = engine.flight_to[flight]
+            if next_airport not in visited:
+                walk(next_airport, legs + (flight,), visited | {next_airport}, cost + weights[flight])
+
+    for origin in engine.airports_in_city(from_city):
+        walk(origin, (), {origin}, 0.0)
+    return sorted(costs)[:limit]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_search_matches_brute_force(module, seed):
+    rng = random.Random(seed)
+    cities = [f"C{i}" for i in range(rng.randint(2, 4))]
+    airports = [(f"A{i}", rng.choice(cities)) for i in range(rng.randint(3, 8))]
+    flights = []
+    for i in range(rng.randint(3, 25)):
+        (from_code, _), (to_code, _) = rng.sample(airports, 2)
+        flights.append((f"F{i}", from_code, to_code, rng.randint(1, 20), rng.randint(1, 20), "o"))
+    engine = module.RouteEngine()
+    engine.load(cities, airports, flights)
+
+    for from_city in cities:
+        for to_city in cities:
+            for sort in ("price", "time"):
+                weights = engine.flight_price if sort == "price" else engine.flight_time
+                for limit in (1, 3, 5, 6):
+                    routes = engine.search(from_city, to_city, sort=sort, limit=limit)
+                    assert [sum(weights[leg] for leg in legs) for legs in routes] == \
+                        brute_force_costs(engine, from_city, to_city, sort, limit, module.MAX_STOPS)
+
+
+def test_search_sees_graph_changes_of_other_processes(module, client, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(module.time, "monotonic", lambda: now[0])
+    FakeGraph.results = {
+        "_batch0": [{"name": "Vilnius"}, {"name": "Riga"}],
+        "_batch1": [{"code": "VNO", "city": "Vilnius"}, {"code": "RIX", "city": "Riga"}],
+    }
+    assert client.get("/search/flights/Vilnius/Riga").status_code == 404
+
+    # Kitas procesas uzregistravo skrydi
+    FakeGraph.version += 1
+    FakeGraph.results["_batch2"] = [{"number": "LY1", "from_code": "VNO", "to_code": "RIX", "price": 50,
+                                     "flightTimeInMinutes": 60, "operator": "o"}]
+
+    # Versija dar netikrinama, grazinamas cache rezultatas
+    assert client.get("/search/flights/Vilnius/Riga").status_code == 404
+
+    now[0] += 2
+    response = client.get("/search/flights/Vilnius/Riga")
+
+    assert response.status_code == 200
+    assert [route["flights"][0]["number"] for route in response.get_json()] == ["LY1"]
+    assert len([call for call in FakeGraph.calls if "GraphVersion" in call[0]]) == 2